@@ -0,0 +1,92 @@
+import numpy as np
+
+from enums import ParcelTimer
+
+
+class ParcelArchive:
+    '''Append-only columnar store of delivered parcels.
+
+    Rows are kept in preallocated NumPy arrays that double in size when full,
+    and running sums of the summed columns are kept alongside, so KPI snapshots
+    don't depend on how many parcels have been archived.
+    '''
+
+    COLUMNS = {
+        'id':                   np.int64,
+        'sender_x':             np.float64,
+        'sender_y':             np.float64,
+        'addressee_x':          np.float64,
+        'addressee_y':          np.float64,
+        'first_mile_wh':        np.int32,
+        'last_mile_wh':         np.int32,
+        'direct_dist':          np.float64,
+        'delivered_at':         np.float64,
+        'time_total':           np.float64,
+        'time_await_courier':   np.float64,
+        'time_await_truck':     np.float64,
+        'time_move_courier':    np.float64,
+        'time_move_truck':      np.float64,
+    }
+
+    TIMER_COLUMNS = {
+        'time_await_courier':   ParcelTimer.AWAIT_COURIER,
+        'time_await_truck':     ParcelTimer.AWAIT_TRUCK,
+        'time_move_courier':    ParcelTimer.MOVE_COURIER,
+        'time_move_truck':      ParcelTimer.MOVE_TRUCK,
+    }
+
+    SUMMED_COLUMNS = ['direct_dist', 'time_total', *TIMER_COLUMNS]
+
+
+    def __init__(self, capacity = 1024):
+        self.size = 0
+        self.columns = {name: np.empty(capacity, dtype)
+                        for name, dtype in self.COLUMNS.items()}
+        self.sums = {name: 0.0 for name in self.SUMMED_COLUMNS}
+
+
+    def __len__(self):
+        return self.size
+
+
+    def append(self, parcel):
+        if self.size == len(self.columns['id']):
+            self.grow()
+
+        timer = parcel.timer
+        row = {
+            'id':               parcel.name,
+            'sender_x':         parcel.sender.x,
+            'sender_y':         parcel.sender.y,
+            'addressee_x':      parcel.addressee.x,
+            'addressee_y':      parcel.addressee.y,
+            'first_mile_wh':    parcel.first_mile_wh.number,
+            'last_mile_wh':     parcel.last_mile_wh.number,
+            'direct_dist':      parcel.direct_dist,
+            # отметка таймера при вручении: в партии посылки вручаются в разное время
+            'delivered_at':     timer.last_clock,
+            'time_total':       timer.total(),
+        }
+        for name, category in self.TIMER_COLUMNS.items():
+            row[name] = timer[category]
+
+        i = self.size
+        for name, value in row.items():
+            self.columns[name][i] = value
+
+        for name in self.sums:
+            self.sums[name] += row[name]
+
+        self.size += 1
+
+
+    def grow(self):
+        for name, column in self.columns.items():
+            grown = np.empty(len(column) * 2, column.dtype)
+            grown[:self.size] = column[:self.size]
+            self.columns[name] = grown
+
+
+    def to_columns(self):
+        '''Trimmed views of the archived columns'''
+        return {name: column[:self.size] for name, column in self.columns.items()}
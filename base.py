@@ -2,6 +2,7 @@ import collections
 from enums import OperationTypes
 import simpy
 
+from spatial import GridIndex
 from utils import *
 
 
@@ -9,33 +10,49 @@ class SimulationObject:
     
     object_type = None
 
+    # посылок и их клиентов в памяти десятки тысяч, поэтому у них нет __dict__;
+    # прочие наследники без __slots__ получают его как обычно
+    __slots__ = ('env', 'uid', 'name', 'x', 'y')
+
 
     def __init__(self, env, name, x, y):
         self.env : simpy.Environment = env
+        self.uid = next(env.object_ids)
         self.name = name
         self.x, self.y = x, y
         self.log_created()        
 
 
     def log_created(self):
-        self.debug(f'Cоздан по координатам ({self.x:.2f}, {self.y:.2f})')
+        self.debug('Cоздан по координатам (%.2f, %.2f)', self.x, self.y)
 
         
     def __repr__(self):
         return self.object_type + (f' "{self.name}"' if self.name != None else '')
+
+
+    def __hash__(self):
+        # порядок обхода множеств объектов не должен зависеть от адресов в памяти,
+        # иначе прогоны с одним seed расходятся
+        return self.uid
     
     
-    def debug(self, msg):
-       self.env.debug(f'{self}: {msg}')
+    def debug(self, msg, *args):
+        if self.env.debug_enabled:
+            self.env.debug('%s: ' + msg, self, *args)
 
 
-    def info(self, msg):
-        self.env.info(f'{self}: {msg}')
+    def info(self, msg, *args):
+        if self.env.info_enabled:
+            self.env.info('%s: ' + msg, self, *args)
 
 
     def find_closest(self, object_list):
         closest = None
         closest_dist = self.env.CITY_RADUIS_KM * 2
+
+        if isinstance(object_list, GridIndex):
+            return object_list.nearest(self.x, self.y, closest_dist)
         
         for contender in object_list:
             contender_dist = dist(self.x, self.y, contender.x, contender.y)
@@ -52,40 +69,90 @@ class SimulationObject:
     
 class StorageAbstract(SimulationObject):
 
+    __slots__ = ('parcels_in_hold', 'parcels_awaiting_couriers', 'parcels_awaiting_trucks')
+
     def __init__(self, env, name, x, y):
         super().__init__(env, name, x, y)
         self.parcels_in_hold = set()
 
+        # посылки, ожидающие назначения, разложены по тому, кого они ждут;
+        # ожидающие грузовика - еще и по складу последней мили
+        self.parcels_awaiting_couriers = set()
+        self.parcels_awaiting_trucks = collections.defaultdict(set)
+
+
+    def dropoff_parcels(self, parcels, mover):
+        # вся партия принимается одним событием, но таймеры посылок 
+        # отмечаются так, как если бы их принимали по одной
+        operation_time = self.operation_time(OperationTypes.DROPOFF, mover)
+        start = self.env.now
+        yield self.env.timeout(operation_time * len(parcels))
+
+        for x, parcel in enumerate(parcels, 1):
+            self.parcels_in_hold.add(parcel)
+            parcel.holder = self
+            parcel.dropoff(mover, start + operation_time * x)
+            self.debug('Получена %s', parcel)
 
-    def dropoff_parcel(self, parcel, mover):
-        yield self.env.timeout(self.operation_time(OperationTypes.DROPOFF, mover))
-        self.parcels_in_hold.add(parcel)
-        parcel.holder = self
-        parcel.dropoff(mover)
-        self.debug(f'Получена {parcel}')
+        self.env.parcels_held[self.object_type] += len(parcels)
 
 
-    def pickup_parcel(self, parcel, mover):
-        yield self.env.timeout(self.operation_time(OperationTypes.PICKUP, mover))
-        if parcel in self.parcels_in_hold:
-            parcel.pickup(mover)
-            self.parcels_in_hold -= {parcel}
+    def pickup_parcels(self, parcels, mover):
+        operation_time = self.operation_time(OperationTypes.PICKUP, mover)
+        start = self.env.now
+        yield self.env.timeout(operation_time * len(parcels))
+
+        missing = parcels - self.parcels_in_hold
+        if missing:
+            raise ValueError(f'{self}: {missing} не найдены для отгрузки')
+
+        for x, parcel in enumerate(parcels, 1):
+            parcel.pickup(mover, start + operation_time * x)
+            self.parcel_assigned(parcel)
             parcel.holder = mover
-            self.debug(f'Отгружена {parcel}')
-        else:
-            raise ValueError(f'{self}: {parcel} не найдена для отгрузки')
+            self.debug('Отгружена %s', parcel)
+
+        self.parcels_in_hold -= parcels
+        self.env.parcels_held[self.object_type] -= len(parcels)
 
 
     def operation_time(self, operation_type, mover):
         raise NotImplementedError
     
 
+    def parcel_awaiting(self, parcel):
+        if parcel.is_awaiting_courier():
+            self.parcels_awaiting_couriers.add(parcel)
+        elif parcel.is_awaiting_truck():
+            self.parcels_awaiting_trucks[parcel.last_mile_wh].add(parcel)
+
+
+    def parcel_assigned(self, parcel):
+        self.parcels_awaiting_couriers.discard(parcel)
+
+        by_last_mile_wh = self.parcels_awaiting_trucks.get(parcel.last_mile_wh)
+        if by_last_mile_wh:
+            by_last_mile_wh.discard(parcel)
+            if not by_last_mile_wh:
+                del self.parcels_awaiting_trucks[parcel.last_mile_wh]
+    
+
     def get_parcels_awaiting_couriers(self):
-        return {p for p in self.parcels_in_hold if p.is_awaiting_courier()}
+        return set(self.parcels_awaiting_couriers)
+
+
+    def count_parcels_awaiting_couriers(self):
+        return len(self.parcels_awaiting_couriers)
+
 
+    def get_parcels_awaiting_trucks(self, last_mile_whs = None):
+        if last_mile_whs is None:
+            last_mile_whs = self.parcels_awaiting_trucks
 
-    def get_parcels_awaiting_trucks(self):
-        return {p for p in self.parcels_in_hold if p.is_awaiting_truck()}
+        awaiting = set()
+        for wh in last_mile_whs:
+            awaiting.update(self.parcels_awaiting_trucks.get(wh, ()))
+        return awaiting
 
 
 class ParcelMover(StorageAbstract):
@@ -99,7 +166,7 @@ class ParcelMover(StorageAbstract):
         self.speed = speed
         self.disp : DispatcherAbstract = dispatcher
         self.current_storage = current_store
-        self.target_storage = None
+        self.target = None
         self.odometer = 0
         
         self.await_dispatch = self.env.event()
@@ -126,34 +193,35 @@ class ParcelMover(StorageAbstract):
 
             self.timer.punch(ParcelMoverTimer.LOADING)
 
-            yield self.env.process(self.load())
+            yield from self.load()
             
             if self.parcels_in_hold:
                 self.timer.punch(ParcelMoverTimer.MOVE_LOADED)
             else:
                 self.timer.punch(ParcelMoverTimer.MOVE_EMPTY)
 
-            yield self.env.process(self.move_to_target())
+            yield from self.move_to_target()
 
             self.timer.punch(ParcelMoverTimer.UNLOADING)
 
-            yield self.env.process(self.unload())
+            yield from self.unload()
             
 
     def load(self):
         parcels_to_load = self.to_load
 
         if parcels_to_load:
-            self.debug(f'Загружаюсь в точке: {self.current_storage}')
+            self.debug('Загружаюсь в точке: %s', self.current_storage)
 
-            for p in parcels_to_load:
-                yield self.env.process(self.current_storage.pickup_parcel(p, self))
+            yield from self.current_storage.pickup_parcels(parcels_to_load, self)
                 
             self.parcels_in_hold.update(parcels_to_load)
+            self.env.parcels_held[self.object_type] += len(parcels_to_load)
 
             self.to_load = None
 
-            self.debug(f'{len(parcels_to_load)} посылок загружено, несу {len(self.parcels_in_hold)} всего')
+            self.debug('%d посылок загружено, несу %d всего', 
+                       len(parcels_to_load), len(self.parcels_in_hold))
         
 
     def move_to_target(self):
@@ -161,14 +229,13 @@ class ParcelMover(StorageAbstract):
         dist_to_target = dist(self.x, self.y, t.x, t.y)
         travel_time = dist_to_target / self.speed
 
-        self.debug(f'Двигаюсь к {t} ({t.x:.2f}, {t.y:.2f}), '
-                   f'{dist_to_target:.1f} км, займет {travel_time:.1f} ч, '
-                   f'ETA {self.env.now + travel_time:.1f}')
+        self.debug('Двигаюсь к %s (%.2f, %.2f), %.1f км, займет %.1f ч, ETA %.1f',
+                   t, t.x, t.y, dist_to_target, travel_time, self.env.now + travel_time)
 
         yield self.env.timeout(travel_time)
 
         self.x, self.y = t.x, t.y
-        self.debug(f'Приехал к {t} ({t.x:.2f}, {t.y:.2f})')
+        self.debug('Приехал к %s (%.2f, %.2f)', t, t.x, t.y)
 
         if self.parcels_in_hold:
             for p in self.parcels_in_hold:
@@ -178,23 +245,24 @@ class ParcelMover(StorageAbstract):
 
         self.current_storage = t
         self.target = None
+        self.disp.mover_arrived(self, t)
 
 
     def unload(self):       
         parcels_to_unload = self.to_unload
         
         if parcels_to_unload:
-            self.debug(f'Разгружаюсь на {self.current_storage}')
+            self.debug('Разгружаюсь на %s', self.current_storage)
 
-            for p in parcels_to_unload:
-                yield self.env.process(self.current_storage.dropoff_parcel(p, self))
-                p.dropoff(self)
+            yield from self.current_storage.dropoff_parcels(parcels_to_unload, self)
                 
             self.parcels_in_hold -= parcels_to_unload
+            self.env.parcels_held[self.object_type] -= len(parcels_to_unload)
 
             self.to_unload = None
     
-            self.debug(f'{len(parcels_to_unload)} посылок разгружено, несу {len(self.parcels_in_hold)} посылок всего')
+            self.debug('%d посылок разгружено, несу %d посылок всего', 
+                       len(parcels_to_unload), len(self.parcels_in_hold))
 
 
     def accept_task(self, target, to_load = None, to_unload = None):
@@ -205,8 +273,9 @@ class ParcelMover(StorageAbstract):
             if p.object_type != 'Посылка':
                 raise ValueError(f'{p} должен быть типа Parcel')
         
-        self.debug(f'Получил задание следовать к {target}')
+        self.debug('Получил задание следовать к %s', target)
         self.target = target
+        self.disp.mover_heading(self, target)
         
         self.to_load = to_load
         for p in to_load:
@@ -221,7 +290,11 @@ class DispatcherAbstract(SimulationObject):
     
     def __init__(self, env, name):
         super().__init__(env, name, 0, 0)
-        self.dispatch_requests = collections.deque()
+
+        # ожидающие задания по порядку запросов и отдельно те, что с грузом:
+        # пока исполнитель ждет, его груз не меняется
+        self.dispatch_requests = collections.OrderedDict()
+        self.loaded_requests = collections.OrderedDict()
         self.movers_awaiting_dispatch_present = env.event()
                 
         self.env.process(self.run())
@@ -233,11 +306,12 @@ class DispatcherAbstract(SimulationObject):
 
     def run(self):
         while True:
-            if sum([len(m.parcels_in_hold) for m in self.dispatch_requests]) == 0:
+            if not self.loaded_requests:
                 yield self.cycle_start_event()
 
             mover = self.pop_next_mover()
-            self.debug(f'Нужно выдать распоряжение для {mover}, и еще {len(self.dispatch_requests)} в очереди')
+            self.debug('Нужно выдать распоряжение для %s, и еще %d в очереди', 
+                       mover, len(self.dispatch_requests))
 
             self.assign_task(mover)
             
@@ -250,26 +324,35 @@ class DispatcherAbstract(SimulationObject):
         raise NotImplementedError
 
             
-    def pop_next_mover(self):
-        non_empty_movers = [m for m in self.dispatch_requests if m.parcels_in_hold]
+    def mover_heading(self, mover, target):
+        pass
 
-        if non_empty_movers:
-            mover = non_empty_movers[0]
-            self.dispatch_requests.remove(mover)
-        else:        
-            mover = self.dispatch_requests.popleft()
 
-        if len(self.dispatch_requests) == 0:
-            self.movers_awaiting_dispatch_present = self.env.event()
+    def mover_arrived(self, mover, storage):
+        pass
 
+            
+    def pop_next_mover(self):
+        mover = next(iter(self.loaded_requests or self.dispatch_requests))
+        self.take_mover(mover)
         return mover
+
+
+    def take_mover(self, mover):
+        del self.dispatch_requests[mover]
+        self.loaded_requests.pop(mover, None)
+
+        if not self.dispatch_requests:
+            self.movers_awaiting_dispatch_present = self.env.event()
         
         
     def request_dispatch(self, mover):
-        self.debug(f'{mover} запросил задачу')
+        self.debug('%s запросил задачу', mover)
 
         succeed(self.movers_awaiting_dispatch_present)
-        self.dispatch_requests.append(mover)
+        self.dispatch_requests[mover] = None
+        if mover.parcels_in_hold:
+            self.loaded_requests[mover] = None
 
     
 class Warehouse(StorageAbstract):
@@ -279,6 +362,7 @@ class Warehouse(StorageAbstract):
 
     def __init__(self, DispatcherClass, env, name, x, y):
         super().__init__(env, name, x, y)
+        self.number = name
         
         self.disp = DispatcherClass(env, self, f'Склад {name}')
 
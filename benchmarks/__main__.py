@@ -0,0 +1,109 @@
+'''Benchmark suite with regression check against stored baselines.
+
+    python -m benchmarks                  # micro-benchmarks, scaling runs and startup
+    python -m benchmarks micro            # only one of them
+    python -m benchmarks --save           # store the results as the new baselines
+
+Baselines live in benchmarks/baselines.json and are only comparable on the
+machine they were recorded on. A measurement worse than its baseline by more
+than --tolerance is reported, and the exit code is 1. So is a measurement
+above the absolute target of its suite (TARGETS in the suite module).
+'''
+
+import argparse
+import json
+import os
+import platform
+import sys
+
+from benchmarks import micro, scaling, startup
+
+BASELINES_PATH = os.path.join(os.path.dirname(__file__), 'baselines.json')
+
+# у каких измерений больше - лучше
+HIGHER_IS_BETTER = {'events_per_sec'}
+
+
+def flatten(results):
+    '''{suite: {case: value or {metric: value}}} -> {'suite/case[/metric]': value}'''
+    flat = {}
+    for suite, cases in results.items():
+        for case, value in cases.items():
+            if isinstance(value, dict):
+                for metric, v in value.items():
+                    flat[f'{suite}/{case}/{metric}'] = v
+            else:
+                flat[f'{suite}/{case}'] = value
+    return flat
+
+
+def compare(results, baselines, tolerance):
+    '''(key, baseline, current, change) of every measurement worse than tolerance allows'''
+    regressions = []
+    current = flatten(results)
+    for key, baseline in flatten(baselines).items():
+        if key not in current or not baseline:
+            continue
+
+        change = current[key] / baseline - 1
+        worse = -change if key.rsplit('/', 1)[-1] in HIGHER_IS_BETTER else change
+        if worse > tolerance:
+            regressions.append((key, baseline, current[key], change))
+    return regressions
+
+
+def missed_targets(results, suites):
+    '''(key, target, current) of every measurement above its suite's target'''
+    missed = []
+    for suite, cases in results.items():
+        for case, target in getattr(suites[suite], 'TARGETS', {}).items():
+            if cases.get(case, 0) > target:
+                missed.append((f'{suite}/{case}', target, cases[case]))
+    return missed
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Бенчмарки горячих путей и масштабирования')
+    parser.add_argument('suites', nargs = '*', help = 'micro, scaling, startup; по умолчанию все')
+    parser.add_argument('--save', action = 'store_true', help = 'записать результаты как новые базовые')
+    parser.add_argument('--tolerance', type = float, default = 0.25, help = 'допустимое ухудшение, доля')
+    args = parser.parse_args()
+
+    suites = {'micro': micro, 'scaling': scaling, 'startup': startup}
+    unknown = set(args.suites) - set(suites)
+    if unknown:
+        parser.error(f'неизвестные наборы {unknown}')
+    results = {suite: suites[suite].run() for suite in args.suites or suites}
+
+    for key, value in flatten(results).items():
+        print(f'{key:60} {value:12.2f}')
+
+    try:
+        with open(BASELINES_PATH, encoding = 'utf-8') as f:
+            stored = json.load(f)
+    except FileNotFoundError:
+        stored = {'machine': None, 'results': {}}
+
+    if args.save:
+        stored = {'machine': platform.platform(), 'results': {**stored['results'], **results}}
+        with open(BASELINES_PATH, 'w', encoding = 'utf-8') as f:
+            json.dump(stored, f, indent = 2)
+        return
+
+    if stored['machine'] != platform.platform():
+        print(f"Базовые значения сняты на другой машине ({stored['machine']})")
+
+    baselines = {suite: stored['results'].get(suite, {}) for suite in results}
+    regressions = compare(results, baselines, args.tolerance)
+    for key, baseline, value, change in regressions:
+        print(f'Регрессия {key}: {baseline:.2f} -> {value:.2f} ({change:+.0%})')
+
+    missed = missed_targets(results, suites)
+    for key, target, value in missed:
+        print(f'Выше цели {key}: {value:.2f} > {target:.2f}')
+
+    sys.exit(1 if regressions or missed else 0)
+
+
+if __name__ == "__main__":
+    main()
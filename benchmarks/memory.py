@@ -0,0 +1,61 @@
+'''Memory taken by parcels, measured with tracemalloc.
+
+    python -m benchmarks.memory                 # bytes per in-flight parcel
+    python -m benchmarks.memory --hours 48      # peak traced memory of a whole run
+
+Parcels are built the way ParcelGenerator builds them, from drawn blocks,
+so each one counts its sender, addressee, timer and events.
+'''
+
+import argparse
+import gc
+import tracemalloc
+
+from main import DeliveryEnvironment
+from parcel import Parcel
+
+
+def parcel_bytes(n = 20000, seed = 1):
+    '''Average traced bytes allocated per parcel'''
+    env = DeliveryEnvironment(seed = seed, run_id = 'memory-benchmark')
+    try:
+        generator = env.parcel_generator
+        generator.draw_block(n)
+        rows = [generator.buffer.popleft() for _ in range(n)]
+
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        parcels = [Parcel(env, x, *parcel_args) for x, (_, *parcel_args) in enumerate(rows)]
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+
+        allocated = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+        return allocated / len(parcels)
+    finally:
+        env.close()
+
+
+def run_peak(hours, seed = 1):
+    '''Peak traced memory of a run, in bytes'''
+    tracemalloc.start()
+    env = DeliveryEnvironment({'SIMULATION_TIME_HRS': hours}, seed, 'memory-benchmark')
+    try:
+        env.simulate(hours)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        env.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'Память на посылки по tracemalloc')
+    parser.add_argument('--parcels', type = int, default = 20000)
+    parser.add_argument('--hours', type = float, help = 'вместо замера на посылку - пик памяти прогона')
+    parser.add_argument('--seed', type = int, default = 1)
+    args = parser.parse_args()
+
+    if args.hours:
+        print(f'Пик памяти за {args.hours} ч: {run_peak(args.hours, args.seed) / 2**20:.1f} МБ')
+    else:
+        print(f'Байт на посылку: {parcel_bytes(args.parcels, args.seed):.0f}')
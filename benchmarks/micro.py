@@ -0,0 +1,90 @@
+'''Micro-benchmarks of the dispatching hot paths on a warmed-up simulation.
+
+Every benchmark is a call that leaves the simulation as it was (truck routes
+are replayed on a stand-in truck), so they can be repeated many times.
+'''
+
+import collections
+import timeit
+import types
+
+from main import DeliveryEnvironment
+from td_petals import CircularRoute
+
+WARMUP_HRS = 8
+
+
+def warmed_up_env(overrides = None, seed = 1):
+    env = DeliveryEnvironment(overrides, seed, 'benchmark')
+    env.simulate(WARMUP_HRS)
+    return env
+
+
+def stand_in_route(td, route):
+    '''The route's copy driving a truck that arrives instantly and loads nothing'''
+    truck = types.SimpleNamespace(current_storage = td.central_wh, parcels_in_hold = set())
+    truck.accept_task = lambda target, to_load, to_unload: setattr(truck, 'current_storage', target)
+    return CircularRoute(td, truck, collections.deque(route.segments))
+
+
+def cases(env):
+    '''name: callable'''
+    whs = env.warehouse_manager.warehouses
+    dispatchers = [wh.disp for wh in whs]
+    couriers = [c for disp in dispatchers for c in disp.couriers]
+    td = env.truck_dispatcher
+    routes = [stand_in_route(td, r) for r in td.routes]
+    busiest = max(dispatchers, key = lambda d: len(d.pickup_requests))
+
+    def find_closest_list():
+        for c in couriers:
+            c.find_closest(whs)
+
+    def find_closest_grid():
+        for c in busiest.couriers:
+            c.find_closest(busiest.pickup_requests)
+
+    def get_parcels_awaiting_couriers():
+        for wh in whs:
+            wh.get_parcels_awaiting_couriers()
+
+    def get_parcels_awaiting_trucks():
+        for wh in whs:
+            wh.get_parcels_awaiting_trucks()
+        for r in routes:
+            td.central_wh.get_parcels_awaiting_trucks(r.peripheral_whs)
+
+    def assign_next_segment():
+        for r in routes:
+            r.assign_next_segment()
+
+    def post_metrics():
+        env.parcel_generator.post_metrics({})
+
+    def get_courier_task():
+        for c in busiest.couriers:
+            busiest.get_courier_task(c)
+
+    return {
+        'find_closest_list': find_closest_list,
+        'find_closest_grid': find_closest_grid,
+        'get_parcels_awaiting_couriers': get_parcels_awaiting_couriers,
+        'get_parcels_awaiting_trucks': get_parcels_awaiting_trucks,
+        'assign_next_segment': assign_next_segment,
+        'parcel_generator_post_metrics': post_metrics,
+        'get_courier_task': get_courier_task,
+    }
+
+
+def run(repeat = 5):
+    '''name: best time per call, µs'''
+    env = warmed_up_env()
+    try:
+        results = {}
+        for name, case in cases(env).items():
+            timer = timeit.Timer(case)
+            number, _ = timer.autorange()
+            results[name] = min(timer.repeat(repeat, number)) / number * 1e6
+        return results
+    finally:
+        env.close()
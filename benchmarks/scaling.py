@@ -0,0 +1,62 @@
+'''End-to-end runs scaled along one parameter at a time.
+
+Every scenario runs in a fresh process, so its peak RSS is its own. Building
+the environment (layout, truck routes) is not timed, only the run. Events
+are the ones simpy processed, counted by wrapping the environment's step.
+'''
+
+import concurrent.futures
+import resource
+import time
+
+import tqdm
+
+SIMULATION_HRS = 12
+
+SCENARIOS = {
+    'warehouses': ('WAREHOUSES_NUMBER', [25, 50, 100]),
+    'couriers': ('COURIERS_PER_WAREHOUSE', [3, 5, 10]),
+    'parcel_rate': ('PARCEL_INTERVAL_HRS', [0.02, 0.01, 0.005]),
+}
+
+
+def scenario_runs():
+    '''name: overrides'''
+    return {f'{scenario}_{value}': {key: value}
+            for scenario, (key, values) in SCENARIOS.items() for value in values}
+
+
+def measure(overrides, seed = 1):
+    from main import DeliveryEnvironment
+
+    env = DeliveryEnvironment({'SIMULATION_TIME_HRS': SIMULATION_HRS, **overrides}, seed, 'benchmark')
+    events = 0
+    step = env.step
+
+    def counted_step():
+        nonlocal events
+        events += 1
+        step()
+
+    env.step = counted_step
+    try:
+        start = time.perf_counter()
+        env.simulate(SIMULATION_HRS)
+        wall = time.perf_counter() - start
+    finally:
+        env.close()
+
+    return {
+        'events_per_sec': events / wall,
+        'wall_ms_per_sim_hr': wall / SIMULATION_HRS * 1000,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def run():
+    '''name: {'events_per_sec', 'wall_ms_per_sim_hr', 'peak_rss_mb'}'''
+    results = {}
+    for name, overrides in tqdm.tqdm(scenario_runs().items()):
+        with concurrent.futures.ProcessPoolExecutor(1) as pool:
+            results[name] = pool.submit(measure, overrides).result()
+    return results
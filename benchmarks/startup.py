@@ -0,0 +1,34 @@
+'''Startup cost of a headless run, measured in fresh interpreters.
+
+This is what every pool worker of a sweep pays before its first simulation.
+pandas and OR-Tools are only imported where they are used (result tables,
+route solving on a cache miss), so they are not part of it. The interpreter's
+own startup is subtracted.
+'''
+
+import subprocess
+import sys
+import time
+
+# верхние границы, мс; превышение - ошибка наравне с регрессией
+TARGETS = {'import_main_ms': 200}
+
+CASES = {
+    'import_main_ms': 'import main',
+    'build_env_ms': 'import main; main.DeliveryEnvironment(seed = 1, run_id = "benchmark").close()',
+}
+
+
+def best_time(code, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], check = True)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def run(repeat = 7):
+    '''name: best time, ms'''
+    interpreter = best_time('pass', repeat)
+    return {name: (best_time(code, repeat) - interpreter) * 1000 for name, code in CASES.items()}
@@ -0,0 +1,132 @@
+import numpy as np
+from ortools.graph.python import linear_sum_assignment
+
+from base import Courier
+from parcel import Sender
+from courier_disp import CourierDispatcherAbstract
+from utils import succeed
+
+
+class CourierDispatcher(CourierDispatcherAbstract):
+    '''Курьеры возят по одной посылке, как в cd_one_parcel, но свободные
+    курьеры склада распределяются по всем запросам на вывоз разом -
+    решением задачи о назначениях по матрице расстояний'''
+
+    object_type = 'Диспетчер курьеров'
+    version = __name__
+
+
+    def __init__(self, env, wh, name):
+        super().__init__(env, wh, name)
+        self.await_changes = env.event()
+
+
+    def run(self):
+        while True:
+            yield self.cycle_start_event()
+
+            if not self.dispatch_batch():
+                # ничего не назначили - ждем новых курьеров или запросов
+                self.await_changes = self.env.event()
+                yield self.await_changes
+
+
+    def request_dispatch(self, mover):
+        super().request_dispatch(mover)
+        succeed(self.await_changes)
+
+
+    def request_pickup(self, parcel):
+        super().request_pickup(parcel)
+        succeed(self.await_changes)
+
+
+    def dispatch_batch(self):
+        free_couriers = []
+        assigned = 0
+
+        for courier in list(self.dispatch_requests):
+            task = self.get_courier_task(courier)
+            if task:
+                self.give_task(courier, *task)
+                assigned += 1
+            else:
+                free_couriers.append(courier)
+
+        targets = [r for r in self.pickup_requests if r != self.wh]
+        if self.wh in self.pickup_requests:
+            targets += [self.wh] * self.wh_slots()
+
+        if free_couriers and targets:
+            self.debug('Распределяю %d свободных курьеров по %d запросам',
+                       len(free_couriers), len(targets))
+
+            for courier, target in self.match(free_couriers, targets):
+                self.give_task(courier, target, set(), set())
+                assigned += 1
+
+        self.patch_pickup_requests()
+
+        return assigned
+
+
+    def get_courier_task(self, courier: Courier):
+        '''Задачи, которые не требуют распределения: отвезти посылку
+        от отправителя на склад или забрать со склада самую старую посылку'''
+
+        if isinstance(courier.current_storage, Sender):
+            parcels = courier.current_storage.parcels_in_hold
+            return self.wh, parcels.copy(), parcels.copy()
+
+        if courier.current_storage == self.wh and self.wh.count_parcels_awaiting_couriers():
+            parcel = max(self.wh.parcels_awaiting_couriers, key = lambda p: p.timer.total())
+            return parcel.addressee, {parcel}, {parcel}
+
+        return None
+
+
+    def give_task(self, courier, target_storage, to_load, to_unload):
+        self.take_mover(courier)
+        courier.accept_task(target_storage, to_load, to_unload)
+        self.pickup_request_served(target_storage)
+        self.debug('Приказываю %s: загрузить %s на %s, двигаться к %s и разгрузить там %s',
+                   courier, to_load, courier.current_storage, target_storage, to_unload)
+
+
+    def wh_slots(self):
+        '''Сколько еще курьеров нужно направить на склад'''
+        return max(self.couriers_needed_for_wh_pickup() - self.couriers_heading_to_wh, 0)
+
+
+    @staticmethod
+    def match(couriers, targets):
+        '''Пары курьер - цель с минимальным суммарным пробегом'''
+
+        courier_xy = np.array([(c.x, c.y) for c in couriers])
+        target_xy = np.array([(t.x, t.y) for t in targets])
+
+        # решатель работает с целыми стоимостями и квадратной матрицей,
+        # поэтому считаем в метрах и дополняем нулевыми строками или столбцами
+        size = max(len(couriers), len(targets))
+        costs = np.zeros((size, size), dtype = np.int64)
+        costs[:len(couriers), :len(targets)] = np.rint(1000 * np.hypot(
+            courier_xy[:, None, 0] - target_xy[None, :, 0],
+            courier_xy[:, None, 1] - target_xy[None, :, 1]))
+
+        solver = linear_sum_assignment.SimpleLinearSumAssignment()
+        solver.add_arcs_with_cost(np.repeat(np.arange(size), size),
+                                  np.tile(np.arange(size), size), costs.ravel())
+
+        if solver.solve() != solver.OPTIMAL:
+            raise RuntimeError('Не могу распределить курьеров по запросам')
+
+        pairs = []
+        for i, courier in enumerate(couriers):
+            j = solver.right_mate(i)
+            if j < len(targets):
+                pairs.append((courier, targets[j]))
+        return pairs
+
+
+    def couriers_needed_for_wh_pickup(self):
+        return self.wh.count_parcels_awaiting_couriers()
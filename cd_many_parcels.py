@@ -12,14 +12,16 @@ class CourierDispatcher(CourierDispatcherAbstract):
 
 
     def get_courier_task(self, courier: Courier):
-        complete_task_list = self.get_complete_task_list(courier)
+        dropoff_task_list = self.get_dropoff_task_list(courier)
         
-        task_num = len(complete_task_list)
+        task_num = len(self.pickup_requests) + len(dropoff_task_list)
 
         if task_num:
-            self.debug(f'Выбираю из {task_num} заданий')
+            self.debug('Выбираю из %d заданий', task_num)
 
-            closest_point = courier.find_closest(complete_task_list)
+            closest_candidates = {courier.find_closest(self.pickup_requests),
+                                  courier.find_closest(dropoff_task_list)} - {None}
+            closest_point = courier.find_closest(closest_candidates)
             to_load = self.get_load_task(courier)
 
             planned_hold = courier.parcels_in_hold | to_load
@@ -30,7 +32,7 @@ class CourierDispatcher(CourierDispatcherAbstract):
             return None
 
 
-    def get_complete_task_list(self, courier):
+    def get_dropoff_task_list(self, courier):
         first_mile_dropoff = {p.first_mile_wh 
                               for p in courier.parcels_in_hold 
                               if p.first_mile_wh == self.wh}
@@ -38,7 +40,7 @@ class CourierDispatcher(CourierDispatcherAbstract):
         last_mile_dropoff = {p.addressee for p in courier.parcels_in_hold 
                                     if p.last_mile_wh == self.wh}
 
-        return self.pickup_requests | first_mile_dropoff | last_mile_dropoff
+        return first_mile_dropoff | last_mile_dropoff
             
             
     def get_load_task(self, courier):
@@ -75,4 +77,4 @@ class CourierDispatcher(CourierDispatcherAbstract):
 
 
     def couriers_needed_for_wh_pickup(self):
-        return 1 if self.wh.get_parcels_awaiting_couriers() else 0
\ No newline at end of file
+        return 1 if self.wh.count_parcels_awaiting_couriers() else 0
\ No newline at end of file
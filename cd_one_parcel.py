@@ -23,8 +23,7 @@ class CourierDispatcher(CourierDispatcherAbstract):
             # пока оттуда не заберут все посылки, то сейчас на склад направляется 
             # избыток курьеров
             if len(outgoing_parcels):
-                parcel = max(self.wh.get_parcels_awaiting_couriers(),
-                    key = lambda p: p.timer.total())
+                parcel = max(outgoing_parcels, key = lambda p: p.timer.total())
                 target_storage = parcel.addressee
                 parcels = {parcel}
             else: # посылочку с центра перехватил и увез кто-то другой
@@ -33,17 +32,18 @@ class CourierDispatcher(CourierDispatcherAbstract):
         elif self.pickup_requests:
             parcels = set()
             target_storage = courier.find_closest(self.pickup_requests)
-            self.debug(f'Ближайший запрос из {len(self.pickup_requests)} активных - от {target_storage}')
+            self.debug('Ближайший запрос из %d активных - от %s', 
+                       len(self.pickup_requests), target_storage)
             
             # если есть более близкие свободные курьеры, то запрос не берем 
-            if self.dispatch_requests:
-                self.debug(f'Проверяем, есть ли более близкие курьеры из '
-                           f'{len(self.dispatch_requests)} свободных, исключая {courier}')
-                closest_free_courier : Courier = target_storage.find_closest(
-                    set(self.dispatch_requests) | {courier})
-                if (closest_free_courier != courier) and \
+            if self.idle_couriers:
+                self.debug('Проверяем, есть ли более близкие курьеры из %d свободных, исключая %s',
+                           len(self.idle_couriers), courier)
+                closest_free_courier : Courier = target_storage.find_closest(self.idle_couriers)
+                if closest_free_courier and \
+                        (target_storage.dist(closest_free_courier) < target_storage.dist(courier)) and \
                         (closest_free_courier.current_storage != courier.current_storage):
-                    self.debug(f'Найден более близкий свободный {closest_free_courier}')
+                    self.debug('Найден более близкий свободный %s', closest_free_courier)
                     return None
         else:
             return None
@@ -52,4 +52,4 @@ class CourierDispatcher(CourierDispatcherAbstract):
     
 
     def couriers_needed_for_wh_pickup(self):
-        return len(self.wh.get_parcels_awaiting_couriers())
+        return self.wh.count_parcels_awaiting_couriers()
@@ -1,4 +1,5 @@
 from base import DispatcherAbstract, Warehouse, Courier, ParcelMover
+from spatial import GridIndex, cell_size_for
 from utils import succeed
 
 class CourierDispatcherAbstract(DispatcherAbstract):
@@ -10,10 +11,15 @@ class CourierDispatcherAbstract(DispatcherAbstract):
         super().__init__(env, name)
         self.await_pickup_needed = env.event()
         self.wh = wh            
+
+        # запросы на вывоз лежат внутри зоны склада, поэтому сетка мельче зоны
+        cell_size = cell_size_for(env.CITY_RADUIS_KM, env.WAREHOUSES_NUMBER * 16)
+        self.pickup_requests = GridIndex(cell_size)
+        self.idle_couriers = GridIndex(cell_size)
+        self.couriers_heading_to_wh = 0
+
         self.couriers = {Courier(env, wh, self, f'{self.wh.name}_{x}')
                          for x in range(env.COURIERS_PER_WAREHOUSE)}
-            
-        self.pickup_requests = set()
 
 
     def cycle_start_event(self):
@@ -22,7 +28,7 @@ class CourierDispatcherAbstract(DispatcherAbstract):
 
     def assign_task(self, courier: ParcelMover):
 
-        self.debug(f'Рассчитываю задачу для {courier}')
+        self.debug('Рассчитываю задачу для %s', courier)
         
         courier_task = self.get_courier_task(courier)
 
@@ -30,10 +36,8 @@ class CourierDispatcherAbstract(DispatcherAbstract):
             (target_storage, to_load, to_unload) = courier_task
             courier.accept_task(target_storage, to_load, to_unload)
             self.pickup_request_served(target_storage)
-            self.debug(f'Приказываю {courier}: '
-                       f'загрузить {to_load} на {courier.current_storage}, '
-                       f'двигаться к {target_storage} '
-                       f'и разгрузить там {to_unload}')
+            self.debug('Приказываю %s: загрузить %s на %s, двигаться к %s и разгрузить там %s',
+                       courier, to_load, courier.current_storage, target_storage, to_unload)
         
         else:            
             self.debug('Нечего делать, буду ждать новых заказов на курьера')
@@ -46,28 +50,54 @@ class CourierDispatcherAbstract(DispatcherAbstract):
         raise NotImplementedError
 
 
+    def request_dispatch(self, mover):
+        super().request_dispatch(mover)
+        self.idle_couriers.add(mover)
+
+
+    def take_mover(self, mover):
+        super().take_mover(mover)
+        self.idle_couriers.discard(mover)
+
+
+    def mover_heading(self, mover, target):
+        if target == self.wh:
+            self.couriers_heading_to_wh += 1
+
+
+    def mover_arrived(self, mover, storage):
+        if storage == self.wh:
+            self.couriers_heading_to_wh -= 1
+
+            # пока к складу ехали, он мог выпасть из списка на вывоз;
+            # приехавший курьер должен забрать то, что там ждет
+            if self.wh.count_parcels_awaiting_couriers():
+                self.pickup_requests.add(self.wh)
+                succeed(self.await_pickup_needed)
+
+
     def request_pickup(self, parcel):
-        self.pickup_requests |= {parcel.holder}
+        self.pickup_requests.add(parcel.holder)
         succeed(self.await_pickup_needed)
         
 
     def pickup_request_served(self, holder):
         if holder != self.wh:
-            self.pickup_requests -= {holder}
+            self.pickup_requests.discard(holder)
 
-        self.debug(f'Удалил {holder} из списка запросов на вывоз, осталось {len(self.pickup_requests)}')
+        self.debug('Удалил %s из списка запросов на вывоз, осталось %d', 
+                   holder, len(self.pickup_requests))
 
 
     def patch_pickup_requests(self):
         if self.wh in self.pickup_requests:
-            if not self.wh.get_parcels_awaiting_couriers():
+            if not self.wh.count_parcels_awaiting_couriers():
                 self.debug('Убираю склад из списка на вывоз - на складе ни одной посылки на вывоз нет')
-                self.pickup_requests -= {self.wh}
+                self.pickup_requests.discard(self.wh)
 
-            couriers_heading_to_wh = len([c for c in self.couriers if c.target_storage == self.wh])
-            if self.couriers_needed_for_wh_pickup() <= couriers_heading_to_wh:
+            if self.couriers_needed_for_wh_pickup() <= self.couriers_heading_to_wh:
                 self.debug('Убираю склад из списка на вывоз - на склад направлено достаточно курьеров')
-                self.pickup_requests -= {self.wh}
+                self.pickup_requests.discard(self.wh)
             
         if not self.pickup_requests:
             self.await_pickup_needed = self.env.event()
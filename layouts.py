@@ -0,0 +1,66 @@
+'''Warehouse layouts.
+
+Equal-circle packings of the unit circle are memoized in process and on disk
+in cache/layouts, so circlify only runs once per warehouse count. A custom
+layout can be loaded from a CSV file with x, y columns in km.
+
+Precompute layouts ahead of time with:
+    python layouts.py 50 100 200
+'''
+
+import csv
+import functools
+import json
+import logging
+import os
+import sys
+
+CACHE_DIR = os.path.join('cache', 'layouts')
+
+
+@functools.lru_cache(maxsize = None)
+def unit_layout(n):
+    '''Centers of n equal circles packed into the unit circle'''
+
+    path = os.path.join(CACHE_DIR, f'{n}.json')
+    try:
+        with open(path, encoding = 'utf-8') as f:
+            return tuple(tuple(point) for point in json.load(f))
+    except (OSError, ValueError):
+        pass
+
+    layout = pack_circles(n)
+
+    os.makedirs(CACHE_DIR, exist_ok = True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding = 'utf-8') as f:
+        json.dump(layout, f)
+    os.replace(tmp_path, path)
+
+    return layout
+
+
+def pack_circles(n):
+    from circlify import circlify
+
+    # circlify пишет предупреждения о каждой неудачной попытке упаковки
+    circlify_log = logging.getLogger('circlify')
+    level = circlify_log.level
+    circlify_log.setLevel(logging.ERROR)
+    try:
+        circles = circlify([1 for i in range(n)])
+    finally:
+        circlify_log.setLevel(level)
+
+    return tuple((c.x, c.y) for c in circles)
+
+
+def load_coordinates(path):
+    '''Warehouse coordinates in km from a CSV file with x, y columns'''
+    with open(path, encoding = 'utf-8', newline = '') as f:
+        return [(float(row['x']), float(row['y'])) for row in csv.DictReader(f)]
+
+
+if __name__ == "__main__":
+    for n in sys.argv[1:]:
+        unit_layout(int(n))
@@ -1,42 +1,101 @@
+import collections
 import configparser
+import contextlib
 import datetime
 import itertools
 import logging
 import os
-import random
 
 import simpy
-import tqdm
 
 from utils import *
 from parcel import ParcelGenerator
 from warehouses import WarehouseManager
 from td_petals import TruckDispatcher
 from metrics import MetricsManager
+from steady_state import SteadyStateDetector
+from profiling import Profiler
+
+def load_config(overrides = None):
+    '''config.ini with overrides applied, as a flat dict of parsed values'''
+    config = configparser.ConfigParser()
+    config.read('config.ini', encoding='utf-8')
+
+    flat_config = dict(list(itertools.chain(*[config.items(s) for s in config.sections()])))
+
+    for key, value in (overrides or {}).items():
+        if key.lower() not in flat_config:
+            raise KeyError(f'Параметра {key} нет в config.ini')
+        flat_config[key.lower()] = value
+
+    return {key: parse_config_value(value) for key, value in flat_config.items()}
+
 
 class DeliveryEnvironment(simpy.Environment):
     
-    def __init__(self):
+    def __init__(self, overrides = None, seed = None, run_id = None):
         super().__init__()
         
-        self.read_config()
+        self.read_config(overrides)
+
+        self.seed = seed
+        self.object_ids = itertools.count()
+
+        self.init_logging(run_id)
 
-        self.init_logging()
+        # посылок на руках у хранилищ каждого типа: складов, курьеров, грузовиков...
+        self.parcels_held = collections.Counter()
+
+        # вызывается с числом прошедших модельных часов при каждом замере KPI
+        self.progress = None
+
+        # профилировщик ставится первым, чтобы считать события с самого начала
+        self.profiler = Profiler(self) if self.PROFILING else None
         
         self.metrics = MetricsManager(self)
 
-        self.parcel_generator = ParcelGenerator(self)
+        with self.profiled('build_parcel_generator'):
+            self.parcel_generator = ParcelGenerator(self)
         self.metrics.track_object(self.parcel_generator)
         
-        self.warehouse_manager = WarehouseManager(self)
+        with self.profiled('build_warehouses'):
+            self.warehouse_manager = WarehouseManager(self)
         self.metrics.track_object(self.warehouse_manager)
         
-        self.truck_dispatcher = TruckDispatcher(self)        
+        # в основном это построение маршрутов в OR-Tools или чтение их из кэша
+        with self.profiled('build_truck_dispatcher'):
+            self.truck_dispatcher = TruckDispatcher(self)        
         self.metrics.track_object(self.truck_dispatcher)
 
+        if self.STEADY_STATE_INTERVAL_HRS:
+            self.steady_state = SteadyStateDetector(self)
+            self.metrics.track_object(self.steady_state)
+
+        if self.profiler:
+            self.profiler.instrument()
+            self.metrics.track_object(self.profiler)
+
+
+    def profiled(self, label):
+        return self.profiler.section(label) if self.profiler else contextlib.nullcontext()
+
+
+    def simulate(self, until = None, progress = None):
+        '''Run up to `until` hours (SIMULATION_TIME_HRS by default) without any UI.
+
+        progress, e.g. tqdm's update, is called with the simulated hours
+        passed at every KPI report.'''
+        self.progress = progress
+        try:
+            self.run(until = self.SIMULATION_TIME_HRS if until is None else until)
+        finally:
+            self.progress = None
+
     
-    def init_logging(self):
-        self.results_timestamp = datetime.datetime.now().strftime("%m%d-%H%M")        
+    def init_logging(self, run_id = None):
+        self.results_timestamp = run_id or datetime.datetime.now().strftime("%m%d-%H%M")        
+
+        os.makedirs('logs', exist_ok = True)
         log_path = f'logs/{self.results_timestamp}.log'
         
         try:
@@ -52,46 +111,52 @@ class DeliveryEnvironment(simpy.Environment):
         handler = logging.FileHandler(log_path, encoding='utf-8')
         handler.setFormatter(formatter)
         self.log.addHandler(handler)
+        self.log_handler = handler
+
+        # сообщения форматируются лениво, а отключенные уровни отсекаются сразу
+        self.debug_enabled = self.log.isEnabledFor(logging.DEBUG)
+        self.info_enabled = self.log.isEnabledFor(logging.INFO)
         
 
-    def read_config(self):
-        config = configparser.ConfigParser()
-        config.read('config.ini', encoding='utf-8')
-
-        flat_config = dict(list(itertools.chain(*[config.items(s) for s in config.sections()])))
-
-        for key in flat_config:
-            value = flat_config[key]
-            try:
-                value = float(value)
-                if value % 1 == 0:
-                    value = int(value)
-            except:
-                pass
-            flat_config[key] = value
+    def read_config(self, overrides = None):
+        flat_config = load_config(overrides)
+
+        for key, value in flat_config.items():
             self.__setattr__(key.upper(), value)
 
         self.flat_config = flat_config
-        
 
-    def info(self, msg):
-        self.log.info(f'{self.now:.2f}: {msg}')
+
+    def stop(self):
+        '''End env.run at the current time, before its until'''
+        event = self.event()
+        event.callbacks.append(simpy.core.StopSimulation.callback)
+        event.succeed()
 
 
-    def debug(self, msg):
-        self.log.debug(f'{self.now:.2f}: {msg}')
+    def close(self):
+        self.metrics.close()
+        self.log.removeHandler(self.log_handler)
+        self.log_handler.close()
+        
+
+    def info(self, msg, *args):
+        if self.info_enabled:
+            self.log.info('%.2f: ' + msg, self.now, *args)
 
 
-    def random_point(self):
-        while True:
-            x = random.random() * 2 - 1
-            y = random.random() * 2 - 1
-            if dist(x, y, 0, 0) <= 1:
-                return (x * self.CITY_RADUIS_KM, y * self.CITY_RADUIS_KM)
+    def debug(self, msg, *args):
+        if self.debug_enabled:
+            self.log.debug('%.2f: ' + msg, self.now, *args)
             
             
 if __name__ == "__main__":
+    import tqdm
+
     env = DeliveryEnvironment()
-    with tqdm.tqdm(total = env.SIMULATION_TIME_HRS) as env.pbar:
-        env.run(until = env.SIMULATION_TIME_HRS)
-    env.metrics.save_results()
\ No newline at end of file
+    try:
+        with tqdm.tqdm(total = env.SIMULATION_TIME_HRS) as pbar:
+            env.simulate(progress = pbar.update)
+        env.metrics.save_results()
+    finally:
+        env.close()
\ No newline at end of file
@@ -1,5 +1,8 @@
-import collections
-import pandas as pd
+import os
+
+from metrics_sink import open_sink
+from results import ResultsStore
+from utils import config_hash
 
 
 class MetricsManager:            
@@ -7,10 +10,18 @@ class MetricsManager:
     def __init__(self, env):
         self.env = env
         self.tracked_objects = set()
-        self.metrics_log = collections.deque()
-        self.results_timestamp = env.results_timestamp
+        self.last_metrics = None
+        self.open_series(env.results_timestamp)
 
         env.process(self.run())
+
+
+    def open_series(self, results_timestamp):
+        '''Start a new metrics file; the rows already reported stay in the previous one'''
+        self.results_timestamp = results_timestamp
+
+        os.makedirs('metrics', exist_ok = True)
+        self.sink = open_sink(self.env.METRICS_FORMAT, f'metrics/{results_timestamp}')
         
     
     def track_object(self, obj):
@@ -21,7 +32,8 @@ class MetricsManager:
         interval = self.env.MONITORING_INTERVAL_HRS
         while True:
             self.report_metrics()
-            self.env.pbar.update(interval)
+            if self.env.progress:
+                self.env.progress(interval)
             yield self.env.timeout(interval)
 
 
@@ -34,47 +46,57 @@ class MetricsManager:
 
         self.log_metrics_to_console(m)
 
-        self.metrics_log.append(m)
+        self.sink.append(m)
+        self.last_metrics = m
+
+
+    def close(self):
+        self.sink.close()
 
 
     def log_metrics_to_console(self, m):
+        if not self.env.info_enabled:
+            return
+
         info = self.env.info
         
         info('')
         info('===== Замер KPI =====')
         for key in m:
-            info(f'{key}: {m[key]}')
+            info('%s: %s', key, m[key])
 
         info('=====================')
         info('')
 
 
     def save_results(self):
+
+        results = self.collect_results()
+
+        ResultsStore().append(results)
         
-        self.report_metrics()
 
-        pd.DataFrame(self.metrics_log).to_csv(f'metrics/{self.results_timestamp}.csv', index = None)
+    def collect_results(self):
+
+        self.report_metrics()
+        self.close()
 
         results = self.prepare_results()
         self.log_metrics_to_console(results)
 
-
-        try:
-            df = pd.read_csv('simulations.csv')
-        except:
-            df = pd.DataFrame()
-        
-        df.append(results, ignore_index = True).to_csv('simulations.csv', index = None)
+        return results
         
 
     def prepare_results(self):
         results = {
-            'timestamp': self.results_timestamp
+            'timestamp': self.results_timestamp,
+            'seed': self.env.seed,
+            'config_hash': config_hash(self.env.flat_config)
         }
 
         results.update(self.env.flat_config)
                 
-        results.update(self.metrics_log.pop())
+        results.update(self.last_metrics)
         
         for obj in self.tracked_objects:
             obj.post_results(results)
@@ -0,0 +1,199 @@
+'''Streaming writers for the metrics series.
+
+Rows are handed to a background thread that appends them to disk in batches
+and flushes after every batch, so an interrupted run keeps everything
+reported up to that point.
+
+Columns are every key seen so far, in order of first appearance. Rows lacking
+a column leave it empty; a key that first appears in a later row (profiling,
+metrics posted only under some conditions) widens the file: what is already
+written is rewritten once under the new header.
+'''
+
+import csv
+import os
+import queue
+import threading
+
+
+class MetricsSink:
+
+    extension = None
+
+    def __init__(self, path, batch_size = 64):
+        self.path = path
+        self.batch_size = batch_size
+        self.queue = queue.Queue()
+        self.error = None
+        self.closed = False
+        # упорядоченное множество колонок
+        self.columns = {}
+
+        self.thread = threading.Thread(target = self.write_loop, daemon = True)
+        self.thread.start()
+
+
+    def append(self, row):
+        self.queue.put(row)
+
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+
+        self.queue.put(None)
+        self.thread.join()
+
+        if self.error:
+            raise self.error
+
+
+    def write_loop(self):
+        try:
+            closing = False
+            while not closing:
+                batch = [self.queue.get()]
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                if batch[-1] is None:
+                    closing = True
+                    batch.pop()
+
+                if batch:
+                    self.write_batch(batch)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.close_file()
+
+
+    def add_columns(self, rows):
+        '''Register the new keys of rows; True if there were any'''
+        known = len(self.columns)
+        for row in rows:
+            for key in row:
+                self.columns.setdefault(key)
+        return len(self.columns) > known
+
+
+    def write_batch(self, rows):
+        raise NotImplementedError
+
+
+    def close_file(self):
+        raise NotImplementedError
+
+
+class CsvMetricsSink(MetricsSink):
+
+    extension = 'csv'
+
+    def __init__(self, path, batch_size = 64):
+        self.file = None
+        super().__init__(path, batch_size)
+
+
+    def write_batch(self, rows):
+        grew = self.add_columns(rows)
+        if self.file is None:
+            self.open_file('w')
+            self.writer.writeheader()
+        elif grew:
+            self.widen()
+
+        self.writer.writerows(rows)
+        self.file.flush()
+
+
+    def open_file(self, mode):
+        self.file = open(self.path, mode, encoding = 'utf-8', newline = '')
+        self.writer = csv.DictWriter(self.file, fieldnames = list(self.columns))
+
+
+    def widen(self):
+        self.file.close()
+
+        # файл с новым заголовком подменяет старый целиком
+        tmp_path = f'{self.path}.tmp'
+        with open(self.path, encoding = 'utf-8', newline = '') as old, \
+                open(tmp_path, 'w', encoding = 'utf-8', newline = '') as new:
+            writer = csv.DictWriter(new, fieldnames = list(self.columns))
+            writer.writeheader()
+            writer.writerows(csv.DictReader(old))
+        os.replace(tmp_path, self.path)
+
+        self.open_file('a')
+
+
+    def close_file(self):
+        if self.file is not None:
+            self.file.close()
+
+
+class ArrowMetricsSink(MetricsSink):
+    '''Arrow IPC stream: every batch is a self-contained record batch,
+    so a truncated file is still readable up to the last complete one'''
+
+    extension = 'arrow'
+
+    def __init__(self, path, batch_size = 64):
+        self.file = None
+        super().__init__(path, batch_size)
+
+
+    def write_batch(self, rows):
+        import pyarrow as pa
+
+        grew = self.add_columns(rows)
+        if self.file is None:
+            self.open_stream()
+        elif grew:
+            self.widen()
+
+        columns = {key: [row.get(key) for row in rows] for key in self.schema.names}
+        self.writer.write_batch(pa.record_batch(columns, schema = self.schema))
+        self.file.flush()
+
+
+    def open_stream(self):
+        import pyarrow as pa
+
+        self.schema = pa.schema([(key, pa.float64()) for key in self.columns])
+        self.file = pa.OSFile(self.path, 'wb')
+        self.writer = pa.ipc.new_stream(self.file, self.schema)
+
+
+    def widen(self):
+        '''A stream has one schema, so the batches written so far are read
+        back and written again under the wider one'''
+        import pyarrow as pa
+
+        self.close_file()
+        with pa.OSFile(self.path, 'rb') as f:
+            batches = list(pa.ipc.open_stream(f))
+
+        self.open_stream()
+        for batch in batches:
+            columns = {key: batch.column(key) if key in batch.schema.names
+                       else pa.nulls(batch.num_rows, pa.float64())
+                       for key in self.schema.names}
+            self.writer.write_batch(pa.record_batch(columns, schema = self.schema))
+
+
+    def close_file(self):
+        if self.file is not None:
+            self.writer.close()
+            self.file.close()
+
+
+SINKS = {sink.extension: sink for sink in [CsvMetricsSink, ArrowMetricsSink]}
+
+
+def open_sink(metrics_format, path_stem):
+    sink_class = SINKS[metrics_format]
+    return sink_class(f'{path_stem}.{sink_class.extension}')
@@ -1,47 +1,124 @@
 import collections
 
+import numpy as np
 from simpy.core import Environment
 
 from utils import *
+from archive import ParcelArchive
 from base import SimulationObject, StorageAbstract
 from enums import OperationTypes, ParcelTimer
+from spatial import nearest_indices
+
+
+NO_PARCELS = frozenset()
 
 
 class ParcelGenerator:
+
+    # сколько посылок разыгрывается за один раз
+    BLOCK_SIZE = 1024
     
     def __init__(self, env):
         self.env = env
-        self.parcels = collections.deque()
+        # посылки в пути; доставленные уходят в архив
+        self.parcels = {}
+        self.archive = ParcelArchive()
+
+        self.parcels_generated = 0
+        self.direct_dist_total = 0
+
+        # у каждого источника случайности свой поток, поэтому поток посылок 
+        # при одном seed не зависит от диспетчеров и прочих настроек
+        arrivals_seed, senders_seed, addressees_seed = np.random.SeedSequence(env.seed).spawn(3)
+        self.arrivals_rng = np.random.default_rng(arrivals_seed)
+        self.senders_rng = np.random.default_rng(senders_seed)
+        self.addressees_rng = np.random.default_rng(addressees_seed)
+
+        self.buffer = collections.deque()
+        self.parcel_factory = Parcel
+
         env.process(self.run())
         
         
     def run(self):
         x = 0
         while True:
-            self.parcels.append(Parcel(self.env, x))
-            yield self.env.timeout(self.env.PARCEL_INTERVAL_HRS)
+            if not self.buffer:
+                self.draw_block(self.BLOCK_SIZE)
+
+            interval, *parcel_args = self.buffer.popleft()
+            parcel = self.parcel_factory(self.env, x, *parcel_args)
+            self.parcels[x] = parcel
+            self.parcels_generated += 1
+            self.direct_dist_total += parcel.direct_dist
+            yield self.env.timeout(interval)
             x += 1
+
+
+    def draw_block(self, n):
+        '''Разыгрывает n посылок разом: точки отправителей и получателей 
+        и ближайшие к ним склады'''
+
+        whs = self.env.warehouse_manager.warehouses
+        wh_coords = self.env.warehouse_manager.coords
+
+        if self.env.POISSON_ARRIVALS:
+            intervals = self.arrivals_rng.exponential(self.env.PARCEL_INTERVAL_HRS, n)
+        else:
+            intervals = np.full(n, self.env.PARCEL_INTERVAL_HRS)
+
+        sender_x, sender_y = self.random_points(self.senders_rng, n)
+        addressee_x, addressee_y = self.random_points(self.addressees_rng, n)
+        first_mile = nearest_indices(sender_x, sender_y, wh_coords)
+        last_mile = nearest_indices(addressee_x, addressee_y, wh_coords)
+
+        if not self.env.ALLOW_SAME_WH_PARCELS:
+            while True:
+                same = np.flatnonzero(first_mile == last_mile)
+                if not len(same):
+                    break
+                sender_x[same], sender_y[same] = self.random_points(self.senders_rng, len(same))
+                addressee_x[same], addressee_y[same] = self.random_points(self.addressees_rng, len(same))
+                first_mile[same] = nearest_indices(sender_x[same], sender_y[same], wh_coords)
+                last_mile[same] = nearest_indices(addressee_x[same], addressee_y[same], wh_coords)
+
+        self.buffer.extend(
+            (interval, (sx, sy), (ax, ay), whs[f], whs[l])
+            for interval, sx, sy, ax, ay, f, l in zip(
+                intervals.tolist(),
+                sender_x.tolist(), sender_y.tolist(), 
+                addressee_x.tolist(), addressee_y.tolist(),
+                first_mile.tolist(), last_mile.tolist()))
+
+
+    def random_points(self, rng, n):
+        '''Равномерно распределенные точки в круге города'''
+        r = self.env.CITY_RADUIS_KM * np.sqrt(rng.random(n))
+        angle = 2 * np.pi * rng.random(n)
+        return r * np.cos(angle), r * np.sin(angle)
+
+
+    def retire(self, parcel):
+        self.archive.append(parcel)
+        del self.parcels[parcel.name]
             
     
     def post_metrics(self, m):
-        m['parcels_generated'] = len(self.parcels)
-        m['parcels_direct_dist_total'] = int(sum([p.direct_dist for p in self.parcels]))
-
-        delivered_parcels = [p for p in self.parcels if p.await_last_mile_dropoff.triggered]
-        m['parcels_delivered_total'] = len(delivered_parcels)
-        m['parcels_delivered_direct_dist_total'] = int(sum(p.direct_dist for p in delivered_parcels))
-
-        if len(delivered_parcels) > 0:
-            m['parcel_time_total'] = \
-                sum(p.timer.total() for p in delivered_parcels) / len(delivered_parcels)
-            m['parcel_time_await_courier'] = \
-                sum(p.timer.timings[ParcelTimer.AWAIT_COURIER] for p in delivered_parcels) / len(delivered_parcels)
-            m['parcel_time_await_truck'] = \
-                sum(p.timer.timings[ParcelTimer.AWAIT_TRUCK] for p in delivered_parcels) / len(delivered_parcels)
-            m['parcel_time_move_courier'] = \
-                sum(p.timer.timings[ParcelTimer.MOVE_COURIER] for p in delivered_parcels) / len(delivered_parcels)
-            m['parcel_time_move_truck'] = \
-                sum(p.timer.timings[ParcelTimer.MOVE_TRUCK] for p in delivered_parcels) / len(delivered_parcels)
+        m['parcels_generated'] = self.parcels_generated
+        m['parcels_direct_dist_total'] = int(self.direct_dist_total)
+
+        delivered = len(self.archive)
+        sums = self.archive.sums
+        m['parcels_delivered_total'] = delivered
+        m['parcels_delivered_direct_dist_total'] = int(sums['direct_dist'])
+
+        # ключи есть в каждом замере, чтобы колонки потока метрик не менялись
+        mean = lambda column: sums[column] / delivered if delivered else None
+        m['parcel_time_total'] = mean('time_total')
+        m['parcel_time_await_courier'] = mean('time_await_courier')
+        m['parcel_time_await_truck'] = mean('time_await_truck')
+        m['parcel_time_move_courier'] = mean('time_move_courier')
+        m['parcel_time_move_truck'] = mean('time_move_truck')
 
 
     def post_results(self, s):
@@ -49,10 +126,13 @@ class ParcelGenerator:
     
 
 class Customer(StorageAbstract):
+    '''Отправитель или получатель одной посылки. Очередей склада у него нет:
+    ожидающие посылки, если кто-то спросит, ищутся среди тех, что у него на руках'''
+
+    __slots__ = ('created_by',)
 
-    def __init__(self, env, parcel):
-        x, y = env.random_point()
-        super().__init__(env, None, x, y)
+    def __init__(self, env, parcel, x, y):
+        SimulationObject.__init__(self, env, None, x, y)
         self.created_by = parcel
 
 
@@ -71,41 +151,78 @@ class Customer(StorageAbstract):
             return self.env.COURIER_ADDRESSEE_DEPOSIT_TIME_HRS
 
 
+    def parcel_awaiting(self, parcel):
+        pass
+
+
+    def parcel_assigned(self, parcel):
+        pass
+
+
+    def get_parcels_awaiting_couriers(self):
+        return {p for p in self.parcels_in_hold if p.is_awaiting_courier()}
+
+
+    def count_parcels_awaiting_couriers(self):
+        return len(self.get_parcels_awaiting_couriers())
+
+
+    def get_parcels_awaiting_trucks(self, last_mile_whs = None):
+        return set()
+
+
 class Sender(Customer):
 
     object_type = 'Отправитель'
 
-    def __init__(self, env, parcel):
-        super().__init__(env, parcel)        
+    __slots__ = ()
+
+    def __init__(self, env, parcel, x, y):
+        super().__init__(env, parcel, x, y)        
         self.parcels_in_hold = {parcel}
+        env.parcels_held[self.object_type] += 1
 
 
 class Addressee(Customer):
 
     object_type = 'Получатель'
+
+    __slots__ = ()
+
+    def __init__(self, env, parcel, x, y):
+        super().__init__(env, parcel, x, y)
+        # множество заводится только при доставке
+        self.parcels_in_hold = NO_PARCELS
+
+
+    def dropoff_parcels(self, parcels, mover):
+        if self.parcels_in_hold is NO_PARCELS:
+            self.parcels_in_hold = set()
+        yield from super().dropoff_parcels(parcels, mover)
         
 
 class Parcel(SimulationObject):
     
     object_type = 'Посылка'
+
+    __slots__ = ('sender', 'holder', 'addressee', 'first_mile_wh', 'last_mile_wh',
+                 'direct_dist', 'timer', 'await_assignment',
+                 'await_first_mile_pickup', 'await_first_mile_dropoff',
+                 'await_truck_pickup', 'await_truck_dropoff',
+                 'await_last_mile_pickup', 'await_last_mile_dropoff')
     
-    def __init__(self, env: Environment, name):
+    def __init__(self, env: Environment, name, sender_point, addressee_point, 
+                 first_mile_wh, last_mile_wh):
         
-        whs = env.warehouse_manager.warehouses
+        super().__init__(env, name, *sender_point)
 
-        while True:
-            self.sender = Sender(env, self)
-            self.holder = self.sender
-            
-            self.addressee = Addressee(env, self)
-            
-            self.first_mile_wh = self.sender.find_closest(whs)
-            self.last_mile_wh = self.addressee.find_closest(whs)
+        self.sender = Sender(env, self, *sender_point)
+        self.holder = self.sender
         
-            if env.ALLOW_SAME_WH_PARCELS or self.first_mile_wh != self.last_mile_wh:
-                break
+        self.addressee = Addressee(env, self, *addressee_point)
         
-        super().__init__(env, name, self.sender.x, self.sender.y)
+        self.first_mile_wh = first_mile_wh
+        self.last_mile_wh = last_mile_wh
         
         self.direct_dist = self.dist(self.addressee)
         self.timer = Timer(env, ParcelTimer)
@@ -133,7 +250,7 @@ class Parcel(SimulationObject):
             self.debug('Оставлена на складе первой мили, ожидаю назначения на перевозку')
             
             while True:
-                self.await_assignment = self.env.event()
+                self.open_assignment()
                 yield self.await_assignment
                 self.debug('Назначена на перевозку, ожидаю перевозки грузовиком')
                 
@@ -163,44 +280,51 @@ class Parcel(SimulationObject):
     def await_courier_assignment(self, wh):
         wh.disp.request_pickup(self)
         self.timer.punch(ParcelTimer.AWAIT_COURIER)
-        self.await_assignment = self.env.event()
+        self.open_assignment()
         yield self.await_assignment
 
 
+    def open_assignment(self):
+        self.await_assignment = self.env.event()
+        self.holder.parcel_awaiting(self)
+
+
     def is_delivery_within_same_wh(self):
         return self.first_mile_wh == self.last_mile_wh
     
 
     def assign(self):
         succeed(self.await_assignment)
+        self.holder.parcel_assigned(self)
     
     
-    def pickup(self, mover):
+    def pickup(self, mover, at = None):
         if self.holder == self.sender:
             succeed(self.await_first_mile_pickup)
-            self.timer.punch(ParcelTimer.MOVE_COURIER)
+            self.timer.punch(ParcelTimer.MOVE_COURIER, at)
 
         elif self.holder == self.last_mile_wh:
             succeed(self.await_last_mile_pickup)
-            self.timer.punch(ParcelTimer.MOVE_COURIER)
+            self.timer.punch(ParcelTimer.MOVE_COURIER, at)
 
         else:
             succeed(self.await_truck_pickup)
-            self.timer.punch(ParcelTimer.MOVE_TRUCK)
+            self.timer.punch(ParcelTimer.MOVE_TRUCK, at)
         
         
-    def dropoff(self, mover):
+    def dropoff(self, mover, at = None):
         if self.holder == self.first_mile_wh:
             succeed(self.await_first_mile_dropoff)
-            self.timer.punch(ParcelTimer.AWAIT_TRUCK)
+            self.timer.punch(ParcelTimer.AWAIT_TRUCK, at)
             
         elif self.holder == self.addressee:
             succeed(self.await_last_mile_dropoff)
-            self.timer.punch(None)
+            self.timer.punch(None, at)
+            self.env.parcel_generator.retire(self)
 
         else:
             succeed(self.await_truck_dropoff)
-            self.timer.punch(ParcelTimer.AWAIT_COURIER)
+            self.timer.punch(ParcelTimer.AWAIT_COURIER, at)
             
             
     def is_awaiting_courier(self):
@@ -0,0 +1,141 @@
+'''Opt-in accounting of wall time per component (PROFILING = 1 in config.ini).
+
+The profiler replaces methods on the instances of one environment with timed
+wrappers, so other environments in the same process are unaffected and a run
+without PROFILING pays nothing. Generator methods (loading and unloading,
+i.e. storage operations) are timed step by step, the time between their
+yields. Timed call sites nest inside simpy event processing (simpy_step),
+which is the whole run.
+
+Results get profile_<label>_sec and profile_<label>_calls for every label,
+plus event counts; the metrics series gets cumulative event counts, so the
+events scheduled per simulated hour can be read off it.
+'''
+
+import collections
+import contextlib
+import time
+
+perf_counter = time.perf_counter
+
+
+class Profiler:
+
+    def __init__(self, env):
+        self.env = env
+        self.seconds = collections.defaultdict(float)
+        self.calls = collections.defaultdict(int)
+        self.events_scheduled = 0
+        self.events_processed = 0
+
+        self.wrap_events()
+
+
+    @contextlib.contextmanager
+    def section(self, label):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add(label, start)
+
+
+    def add(self, label, start):
+        self.seconds[label] += perf_counter() - start
+        self.calls[label] += 1
+
+
+    def timed(self, method, label):
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.add(label, start)
+        return wrapper
+
+
+    def timed_steps(self, method, label):
+        '''Wrapper of a generator method that times every step between yields'''
+
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            steps = method(*args, **kwargs)
+            value = None
+            while True:
+                try:
+                    event = steps.send(value)
+                except StopIteration as stop:
+                    self.add(label, start)
+                    return stop.value
+                self.add(label, start)
+                value = yield event
+                start = perf_counter()
+        return wrapper
+
+
+    def wrap(self, obj, method_name, label, steps = False):
+        method = getattr(obj, method_name, None)
+        if method is not None:
+            timed = self.timed_steps if steps else self.timed
+            setattr(obj, method_name, timed(method, label))
+
+
+    def wrap_events(self):
+        env = self.env
+        schedule = env.schedule
+        step = self.timed(env.step, 'simpy_step')
+
+        def counted_schedule(*args, **kwargs):
+            self.events_scheduled += 1
+            return schedule(*args, **kwargs)
+
+        def counted_step():
+            self.events_processed += 1
+            return step()
+
+        env.schedule = counted_schedule
+        env.step = counted_step
+
+
+    def instrument(self):
+        '''Wrap the call sites of the built environment'''
+        env = self.env
+
+        generator = env.parcel_generator
+        self.wrap(generator, 'parcel_factory', 'parcel_init')
+        self.wrap(generator, 'draw_block', 'parcel_draw_block')
+        self.wrap(generator, 'retire', 'parcel_retire')
+
+        dispatchers = [wh.disp for wh in env.warehouse_manager.warehouses] + [env.truck_dispatcher]
+        for disp in dispatchers:
+            # cd_batch раздает задания пачками в dispatch_batch, а не в assign_task
+            self.wrap(disp, 'assign_task', f'assign_task_{disp.version}')
+            self.wrap(disp, 'dispatch_batch', f'dispatch_batch_{disp.version}')
+
+        self.wrap(env.truck_dispatcher, 'solve_backlog_routes', 'ortools_replan')
+
+        movers = [c for disp in dispatchers[:-1] for c in disp.couriers] + env.truck_dispatcher.trucks
+        for mover in movers:
+            self.wrap(mover, 'load', 'storage_pickup', steps = True)
+            self.wrap(mover, 'unload', 'storage_dropoff', steps = True)
+
+        for obj in env.metrics.tracked_objects:
+            self.wrap(obj, 'post_metrics', f'post_metrics_{type(obj).__name__}')
+        self.wrap(env.metrics, 'report_metrics', 'report_metrics')
+
+
+    def post_metrics(self, m):
+        m['events_scheduled'] = self.events_scheduled
+        m['events_processed'] = self.events_processed
+
+
+    def post_results(self, m):
+        for label in sorted(self.seconds):
+            m[f'profile_{label}_sec'] = self.seconds[label]
+            m[f'profile_{label}_calls'] = self.calls[label]
+
+        m['profile_events_scheduled'] = self.events_scheduled
+        m['profile_events_processed'] = self.events_processed
+        m['profile_events_scheduled_per_sim_hr'] = \
+            self.events_scheduled / self.env.now if self.env.now else None
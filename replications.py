@@ -0,0 +1,144 @@
+'''Independent replications of one configuration with confidence intervals.
+
+Examples:
+    python replications.py COURIERS_PER_WAREHOUSE=5 --precision 0.05
+    python replications.py --metrics unit_costs_total --confidence 0.99 --max 200
+
+Replication N runs with seed + N. Replications keep being started until the
+confidence interval of every metric is narrower than the requested share of
+its mean (relative precision), or until --max replications have run. The
+decision is always made on the first N replications in seed order, so the
+outcome does not depend on which worker finishes first.
+'''
+
+import argparse
+import concurrent.futures
+import datetime
+import os
+import random
+
+from sweep import run_simulation
+from utils import confidence_interval, parse_config_value, relative_precision
+
+DEFAULT_METRICS = ['unit_costs_total', 'parcel_time_total']
+
+
+def summarize(rows, metrics, confidence):
+    summary = {}
+    for metric in metrics:
+        mean, half_width = confidence_interval([row[metric] for row in rows], confidence)
+        summary[metric] = {
+            'mean': mean,
+            'half_width': half_width,
+            'ci_low': mean - half_width,
+            'ci_high': mean + half_width,
+            'relative_precision': relative_precision(mean, half_width),
+        }
+    return summary
+
+
+def run_replications(overrides = None, metrics = DEFAULT_METRICS, precision = 0.05,
+                     confidence = 0.95, min_replications = 5, max_replications = 100,
+                     workers = None, seed = None, run_id = None, use_cache = True):
+    '''Replicate one config until the requested relative precision is reached.
+
+    Returns the result rows of the replications used and the summary
+    {metric: {'mean', 'half_width', 'ci_low', 'ci_high', 'relative_precision'}}.
+
+    Once the precision is reached the function returns without waiting for
+    the replications still running: up to workers - 1 of them finish in the
+    background, and their rows are left out of the returned ones (run_simulation
+    still stores them in the results store and the run cache).'''
+    import tqdm
+
+    if seed is None:
+        seed = random.randrange(2**32)
+    if run_id is None:
+        run_id = datetime.datetime.now().strftime("%m%d-%H%M%S")
+    workers = workers or os.cpu_count()
+    min_replications = max(min_replications, 2)
+
+    done = {}
+    rows = []
+    summary = None
+    next_replication = 0
+
+    pool = concurrent.futures.ProcessPoolExecutor(workers)
+    pbar = tqdm.tqdm(total = max_replications)
+    running = {}
+    try:
+        def submit():
+            nonlocal next_replication
+            x = next_replication
+            next_replication += 1
+            running[pool.submit(run_simulation, overrides, seed + x, f'{run_id}-{x}', use_cache)] = x
+
+        for _ in range(min(max(workers, min_replications), max_replications)):
+            submit()
+
+        while running:
+            finished, _ = concurrent.futures.wait(running, return_when = concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                x = running.pop(future)
+                done[x] = {**future.result(), 'replication': x}
+                pbar.update()
+
+            # решение принимаем только по непрерывному префиксу повторов
+            while len(rows) in done:
+                rows.append(done.pop(len(rows)))
+
+            if len(rows) >= min_replications:
+                summary = summarize(rows, metrics, confidence)
+                if all(s['relative_precision'] <= precision for s in summary.values()):
+                    break
+
+            while len(running) < workers and next_replication < max_replications:
+                submit()
+    finally:
+        pbar.close()
+        # уже идущие повторы не прервать, но и ждать их незачем
+        pool.shutdown(wait = False, cancel_futures = True)
+
+    if summary is None or len(rows) < min_replications:
+        summary = summarize(rows, metrics, confidence)
+
+    return rows, summary
+
+
+def main():
+    import pandas as pd
+
+    parser = argparse.ArgumentParser(description = 'Повторные прогоны одной конфигурации с доверительными интервалами')
+    parser.add_argument('overrides', nargs = '*', help = 'КЛЮЧ=значение')
+    parser.add_argument('--metrics', nargs = '+', default = DEFAULT_METRICS)
+    parser.add_argument('--precision', type = float, default = 0.05,
+                        help = 'допустимая полуширина интервала в долях от среднего')
+    parser.add_argument('--confidence', type = float, default = 0.95)
+    parser.add_argument('--min', type = int, default = 5, dest = 'min_replications')
+    parser.add_argument('--max', type = int, default = 100, dest = 'max_replications')
+    parser.add_argument('--workers', type = int, default = os.cpu_count())
+    parser.add_argument('--seed', type = int, help = 'базовый seed, у повтора N будет seed + N')
+    parser.add_argument('--no-cache', action = 'store_true', help = 'не брать прогоны из кэша')
+    args = parser.parse_args()
+
+    overrides = {}
+    for assignment in args.overrides:
+        key, _, value = assignment.partition('=')
+        overrides[key.upper()] = parse_config_value(value)
+
+    run_id = datetime.datetime.now().strftime("%m%d-%H%M%S")
+    rows, summary = run_replications(overrides, args.metrics, args.precision, args.confidence,
+                                     args.min_replications, args.max_replications,
+                                     args.workers, args.seed, run_id, not args.no_cache)
+
+    os.makedirs('replications', exist_ok = True)
+    pd.DataFrame(rows).to_csv(f'replications/{run_id}.csv', index = None)
+
+    print(f'Повторов: {len(rows)}')
+    for metric, s in summary.items():
+        print(f"{metric}: {s['mean']:.4f} ± {s['half_width']:.4f} "
+              f"({args.confidence:.0%}, точность {s['relative_precision']:.1%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+'''Results store: one row per simulation run in SQLite.
+
+Runs append their prepare_results row in a single write transaction, so
+parallel runs can share the database. The table grows new columns as new
+result keys appear, and the columns analyses filter on are indexed.
+
+Exporting and importing CSV, e.g. for the Tableau workbook:
+    python results.py export simulations.csv
+    python results.py import simulations.csv
+'''
+
+import sqlite3
+import sys
+
+DEFAULT_PATH = 'simulations.sqlite'
+
+
+class ResultsStore:
+
+    TABLE = 'simulations'
+    INDEXED_COLUMNS = ['timestamp', 'config_hash', 'ver_disp_courier', 'ver_disp_truck']
+
+    def __init__(self, path = DEFAULT_PATH, timeout = 60):
+        self.path = path
+        self.timeout = timeout
+
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout = self.timeout, isolation_level = None)
+        connection.execute('PRAGMA journal_mode = WAL')
+        return connection
+
+
+    def append(self, row):
+        connection = self.connect()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            self.ensure_columns(connection, row)
+
+            columns = ', '.join(quote(key) for key in row)
+            placeholders = ', '.join('?' for _ in row)
+            connection.execute(f'INSERT INTO {self.TABLE} ({columns}) VALUES ({placeholders})',
+                               list(row.values()))
+            connection.execute('COMMIT')
+        except:
+            if connection.in_transaction:
+                connection.execute('ROLLBACK')
+            raise
+        finally:
+            connection.close()
+
+
+    def ensure_columns(self, connection, row):
+        existing = {r[1] for r in connection.execute(f'PRAGMA table_info({self.TABLE})')}
+
+        if not existing:
+            columns = ', '.join(f'{quote(key)} {sql_type(value)}' for key, value in row.items())
+            connection.execute(f'CREATE TABLE {self.TABLE} ({columns})')
+            existing = set(row)
+        else:
+            for key, value in row.items():
+                if key not in existing:
+                    connection.execute(
+                        f'ALTER TABLE {self.TABLE} ADD COLUMN {quote(key)} {sql_type(value)}')
+                    existing.add(key)
+
+        for column in self.INDEXED_COLUMNS:
+            if column in existing:
+                connection.execute(f'CREATE INDEX IF NOT EXISTS {quote("idx_" + column)} '
+                                   f'ON {self.TABLE} ({quote(column)})')
+
+
+    def read(self, where = None, params = (), columns = None):
+        '''Rows matching an optional SQL condition, as a DataFrame'''
+        import pandas as pd
+
+        selected = ', '.join(quote(c) for c in columns) if columns else '*'
+        query = f'SELECT {selected} FROM {self.TABLE}'
+        if where:
+            query += f' WHERE {where}'
+
+        connection = self.connect()
+        try:
+            return pd.read_sql_query(query, connection, params = params)
+        finally:
+            connection.close()
+
+
+    def export_csv(self, path):
+        self.read().to_csv(path, index = None)
+
+
+    def import_csv(self, path):
+        import pandas as pd
+
+        for row in pd.read_csv(path).to_dict('records'):
+            self.append({key: None if value != value else value for key, value in row.items()})
+
+
+def quote(identifier):
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def sql_type(value):
+    if isinstance(value, int):
+        return 'INTEGER'
+    if isinstance(value, float):
+        return 'REAL'
+    if isinstance(value, str):
+        return 'TEXT'
+    return ''
+
+
+if __name__ == "__main__":
+    command, path = sys.argv[1:3]
+    store = ResultsStore()
+    if command == 'export':
+        store.export_csv(path)
+    elif command == 'import':
+        store.import_csv(path)
+    else:
+        raise SystemExit(f'Неизвестная команда {command}, ожидается export или import')
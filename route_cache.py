@@ -0,0 +1,46 @@
+'''On-disk cache of solved truck route plans.
+
+A plan is a list of warehouse index sequences, one per truck, each starting
+at the depot. Plans are keyed by the routing problem itself: the distance
+matrix, the number of vehicles, the depot and the maximum route length.
+'''
+
+import hashlib
+import json
+import os
+
+CACHE_DIR = os.path.join('cache', 'routes')
+
+
+def plan_key(dist_matrix, vehicles, depot, max_route_len):
+    problem = {
+        'dist_matrix': [[round(d, 6) for d in row] for row in dist_matrix],
+        'vehicles': vehicles,
+        'depot': depot,
+        'max_route_len': max_route_len,
+    }
+    return hashlib.sha256(json.dumps(problem).encode()).hexdigest()
+
+
+def plan_path(key):
+    return os.path.join(CACHE_DIR, f'{key}.json')
+
+
+def load_plan(key):
+    try:
+        with open(plan_path(key), encoding = 'utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_plan(key, plan):
+    os.makedirs(CACHE_DIR, exist_ok = True)
+
+    # пишем во временный файл и подменяем, чтобы параллельные прогоны
+    # не прочитали недописанный план
+    path = plan_path(key)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding = 'utf-8') as f:
+        json.dump(plan, f)
+    os.replace(tmp_path, path)
@@ -0,0 +1,119 @@
+'''Cache of whole simulation runs.
+
+A run is identified by its resolved config, its seed, the contents of the
+warehouse layout file if one is set, and the source of every simulation
+module, so editing any of them invalidates the cached runs. Each entry keeps
+the result row and a copy of the metrics series.
+
+Housekeeping:
+    python run_cache.py prune   # drop entries made with outdated sources
+    python run_cache.py clear   # drop everything
+'''
+
+import glob
+import hashlib
+import json
+import os
+import shutil
+import sys
+
+from utils import config_hash
+
+CACHE_DIR = os.path.join('cache', 'runs')
+
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def source_files():
+    '''Every simulation module: the package's .py files except tests'''
+    return sorted(path for path in glob.glob(os.path.join(SOURCE_DIR, '*.py'))
+                  if not os.path.basename(path).startswith('test_'))
+
+
+def source_hash():
+    h = hashlib.sha256()
+    for path in source_files():
+        h.update(os.path.basename(path).encode())
+        with open(path, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()[:16]
+
+
+def file_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+
+def run_key(flat_config, seed):
+    layout_file = flat_config.get('warehouses_layout_file')
+    return config_hash({
+        'config': flat_config,
+        'seed': seed,
+        'sources': source_hash(),
+        'layout': file_hash(layout_file) if layout_file else None,
+    })
+
+
+def entry_dir(key):
+    return os.path.join(CACHE_DIR, key)
+
+
+def load_run(key):
+    '''(result row, path of the cached metrics series) or None'''
+    try:
+        with open(os.path.join(entry_dir(key), 'entry.json'), encoding = 'utf-8') as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    return entry['results'], os.path.join(entry_dir(key), entry['metrics_file'])
+
+
+def save_run(key, results, metrics_path):
+    path = entry_dir(key)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    os.makedirs(tmp_path, exist_ok = True)
+
+    metrics_file = 'metrics' + os.path.splitext(metrics_path)[1]
+    shutil.copyfile(metrics_path, os.path.join(tmp_path, metrics_file))
+
+    entry = {
+        'results': results,
+        'metrics_file': metrics_file,
+        'sources': source_hash(),
+    }
+    with open(os.path.join(tmp_path, 'entry.json'), 'w', encoding = 'utf-8') as f:
+        json.dump(entry, f)
+
+    # запись появляется целиком; если другой процесс успел первым, оставляем его
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        shutil.rmtree(tmp_path, ignore_errors = True)
+
+
+def prune():
+    if not os.path.isdir(CACHE_DIR):
+        return
+
+    current = source_hash()
+    for key in os.listdir(CACHE_DIR):
+        try:
+            with open(os.path.join(entry_dir(key), 'entry.json'), encoding = 'utf-8') as f:
+                entry = json.load(f)
+            stale = entry['sources'] != current
+        except (OSError, ValueError, KeyError):
+            stale = True
+
+        if stale:
+            shutil.rmtree(entry_dir(key), ignore_errors = True)
+
+
+if __name__ == "__main__":
+    command = sys.argv[1]
+    if command == 'prune':
+        prune()
+    elif command == 'clear':
+        shutil.rmtree(CACHE_DIR, ignore_errors = True)
+    else:
+        raise SystemExit(f'Неизвестная команда {command}, ожидается prune или clear')
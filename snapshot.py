@@ -0,0 +1,192 @@
+'''Warm up a simulation once and continue it under several parameter sets.
+
+Example:
+    python snapshot.py --warmup 20 --seed 42 COURIER_WAREHOUSE_PICKUP_TIME_HRS=0.05,0.1,0.2
+
+The warmed-up environment (parcels, storages, movers, dispatcher queues, RNG
+state) is checkpointed by forking the process: simpy processes are live
+generators and cannot be pickled, so the checkpoint lives in the parent and
+every variant continues from it in a forked child. All variants therefore
+see the same parcel stream after the fork as well.
+
+Only parameters that are read while the simulation runs can be changed after
+the fork; those fixed when the objects are built (see STRUCTURAL_KEYS) raise
+ValueError. Each variant writes its own log and a metrics file that starts at
+the fork; the warm-up series stays in the file of the warm-up run.
+'''
+
+import argparse
+import datetime
+import multiprocessing
+import os
+import queue as queue_module
+import random
+import traceback
+
+from main import DeliveryEnvironment
+from results import ResultsStore
+from sweep import expand_grid, parse_grid
+
+# параметры, по которым уже построены склады, курьеры, грузовики и маршруты
+STRUCTURAL_KEYS = {
+    'CITY_RADUIS_KM', 'WAREHOUSES_NUMBER', 'WAREHOUSES_LAYOUT_FILE',
+    'COURIER_DISPATCHER', 'COURIERS_PER_WAREHOUSE', 'COURIER_SPEED_KMH',
+    'TRUCKS_NUMBER', 'TRUCK_SPEED_KMH', 'MAX_ROUTE_LEN',
+    'ROUTE_CACHE', 'ROUTE_SOLVER_TIME_LIMIT_SEC', 'ROUTE_SOLVER_METAHEURISTIC',
+    'ROUTE_REPLAN_INTERVAL_HRS',
+    'MONITORING_INTERVAL_HRS', 'STEADY_STATE_INTERVAL_HRS', 'METRICS_FORMAT', 'PROFILING',
+}
+
+# параметры потока посылок, уже разыгранного блоками наперед
+ARRIVAL_KEYS = {'PARCEL_INTERVAL_HRS', 'POISSON_ARRIVALS', 'ALLOW_SAME_WH_PARCELS'}
+
+
+def check_overrides(env, overrides):
+    for key in overrides:
+        if key.lower() not in env.flat_config:
+            raise KeyError(f'Параметра {key} нет в config.ini')
+        if key.upper() in STRUCTURAL_KEYS:
+            raise ValueError(f'Параметр {key} нельзя менять после разгона')
+
+
+def apply_overrides(env, overrides):
+    check_overrides(env, overrides)
+
+    for key, value in overrides.items():
+        key = key.upper()
+        setattr(env, key, value)
+        env.flat_config[key.lower()] = value
+
+    if ARRIVAL_KEYS & {key.upper() for key in overrides}:
+        # остаток блока разыгран по старым параметрам
+        env.parcel_generator.buffer.clear()
+
+
+class WarmedUpSimulation:
+
+    # как часто проверять, живы ли потомки, пока от них нет результатов
+    POLL_INTERVAL_SEC = 1
+
+    def __init__(self, warmup_hrs, overrides = None, seed = None, run_id = None):
+        self.env = DeliveryEnvironment(overrides, seed, run_id)
+        self.warmup_hrs = warmup_hrs
+
+        self.env.simulate(warmup_hrs)
+
+        # поток метрик разгона закрываем до fork, чтобы потомкам не достался его поток записи
+        self.env.metrics.close()
+
+
+    def fork(self, variants, workers = None, run_id = None, save = True):
+        '''Continue the warmed-up run under every overrides dict in variants,
+        up to `workers` children at a time; returns their result rows in order'''
+
+        if run_id is None:
+            run_id = datetime.datetime.now().strftime("%m%d-%H%M%S")
+        workers = workers or os.cpu_count()
+        for overrides in variants:
+            check_overrides(self.env, overrides)
+
+        context = multiprocessing.get_context('fork')
+        queue = context.Queue()
+        pending = list(enumerate(variants))
+        running = {}
+        rows = [None] * len(variants)
+
+        try:
+            while pending or running:
+                while pending and len(running) < workers:
+                    x, overrides = pending.pop(0)
+                    child = context.Process(target = self.continue_run,
+                                            args = (overrides, f'{run_id}-{x}', x, queue, save))
+                    child.start()
+                    running[x] = child
+
+                x, row = self.next_row(queue, running)
+                running.pop(x).join()
+                if isinstance(row, str):
+                    raise RuntimeError(f'Вариант {x} упал:\n{row}')
+                rows[x] = row
+        finally:
+            for child in running.values():
+                child.terminate()
+                child.join()
+
+        return rows
+
+
+    def next_row(self, queue, running):
+        '''(x, row) posted by a child; raises if a child exited without posting,
+        e.g. killed for memory or crashed inside OR-Tools'''
+        while True:
+            try:
+                return queue.get(timeout = self.POLL_INTERVAL_SEC)
+            except queue_module.Empty:
+                pass
+
+            dead = [x for x, child in running.items() if child.exitcode is not None]
+            if dead:
+                # потомок мог записать результат прямо перед выходом
+                try:
+                    return queue.get(timeout = self.POLL_INTERVAL_SEC)
+                except queue_module.Empty:
+                    x = dead[0]
+                    raise RuntimeError(
+                        f'Вариант {x} завершился с кодом {running[x].exitcode}, не вернув результат')
+
+
+    def continue_run(self, overrides, run_id, x, queue, save):
+        env = self.env
+        try:
+            apply_overrides(env, overrides)
+
+            # файл лога разгона достался от родителя, закрываем свою копию
+            env.log.removeHandler(env.log_handler)
+            env.log_handler.close()
+            env.init_logging(run_id)
+            env.metrics.open_series(run_id)
+
+            env.simulate()
+
+            results = env.metrics.collect_results()
+            results['fork_time_hrs'] = self.warmup_hrs
+            if save:
+                ResultsStore().append(results)
+
+            queue.put((x, results))
+        except BaseException:
+            queue.put((x, traceback.format_exc()))
+        finally:
+            env.close()
+
+
+    def close(self):
+        self.env.close()
+
+
+def main():
+    import pandas as pd
+
+    parser = argparse.ArgumentParser(description = 'Один разгон, продолжения с разными параметрами')
+    parser.add_argument('grid', nargs = '*', help = 'КЛЮЧ=значение1,значение2,...')
+    parser.add_argument('--warmup', type = float, required = True, help = 'длительность общего разгона, ч')
+    parser.add_argument('--workers', type = int, default = os.cpu_count())
+    parser.add_argument('--seed', type = int)
+    args = parser.parse_args()
+
+    seed = random.randrange(2**32) if args.seed is None else args.seed
+    run_id = datetime.datetime.now().strftime("%m%d-%H%M%S")
+
+    simulation = WarmedUpSimulation(args.warmup, seed = seed, run_id = f'{run_id}-warmup')
+    try:
+        variants = expand_grid(parse_grid(args.grid))
+        rows = simulation.fork(variants, args.workers, run_id)
+    finally:
+        simulation.close()
+
+    os.makedirs('sweeps', exist_ok = True)
+    pd.DataFrame(rows).to_csv(f'sweeps/{run_id}.csv', index = None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import math
+
+import numpy as np
+
+from utils import dist
+
+
+def cell_size_for(radius, n):
+    '''Cell size giving about one cell per object for n objects over the city'''
+    return 2 * radius / math.sqrt(max(n, 1))
+
+
+def nearest_indices(xs, ys, coords, chunk_size = 4096):
+    '''For each point, the index of the closest row of coords (an n x 2 array)'''
+    result = np.empty(len(xs), dtype = np.intp)
+    for start in range(0, len(xs), chunk_size):
+        stop = start + chunk_size
+        dx = xs[start:stop, None] - coords[None, :, 0]
+        dy = ys[start:stop, None] - coords[None, :, 1]
+        result[start:stop] = np.argmin(dx * dx + dy * dy, axis = 1)
+    return result
+
+
+class GridIndex:
+    '''Uniform grid over the city plane for nearest-neighbour lookups.
+
+    Behaves like a set of simulation objects (anything with x, y), so it can
+    stand in for the plain sets the dispatchers keep. An object's cell is
+    fixed at insertion time: objects that move must be removed and re-added.
+    '''
+
+    # below this size a plain scan beats walking the grid rings
+    LINEAR_SCAN_MAX = 8
+
+    def __init__(self, cell_size, objects = ()):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.cell_of = {}
+        self.bounds = None
+
+        for obj in objects:
+            self.add(obj)
+
+
+    def __len__(self):
+        return len(self.cell_of)
+
+
+    def __iter__(self):
+        return iter(self.cell_of)
+
+
+    def __contains__(self, obj):
+        return obj in self.cell_of
+
+
+    def cell_key(self, x, y):
+        return math.floor(x / self.cell_size), math.floor(y / self.cell_size)
+
+
+    def add(self, obj):
+        if obj in self.cell_of:
+            return
+
+        key = self.cell_key(obj.x, obj.y)
+        self.cells.setdefault(key, set()).add(obj)
+        self.cell_of[obj] = key
+
+        i, j = key
+        if self.bounds is None:
+            self.bounds = [i, i, j, j]
+        else:
+            b = self.bounds
+            b[0], b[1] = min(b[0], i), max(b[1], i)
+            b[2], b[3] = min(b[2], j), max(b[3], j)
+
+
+    def discard(self, obj):
+        key = self.cell_of.pop(obj, None)
+        if key is None:
+            return
+
+        cell = self.cells[key]
+        cell.discard(obj)
+        if not cell:
+            del self.cells[key]
+
+
+    def nearest(self, x, y, max_dist = math.inf):
+        '''Closest object strictly nearer than max_dist, or None'''
+
+        closest = None
+        closest_dist = max_dist
+
+        if len(self.cell_of) <= self.LINEAR_SCAN_MAX:
+            for contender in self.cell_of:
+                contender_dist = dist(x, y, contender.x, contender.y)
+                if contender_dist < closest_dist:
+                    closest = contender
+                    closest_dist = contender_dist
+            return closest
+
+        ci, cj = self.cell_key(x, y)
+        min_i, max_i, min_j, max_j = self.bounds
+        max_ring = max(ci - min_i, max_i - ci, cj - min_j, max_j - cj)
+
+        for ring in range(max_ring + 1):
+            # everything beyond this ring is at least ring * cell_size away
+            if closest is not None and closest_dist <= (ring - 1) * self.cell_size:
+                break
+
+            for key in self.ring_keys(ci, cj, ring):
+                for contender in self.cells.get(key, ()):
+                    contender_dist = dist(x, y, contender.x, contender.y)
+                    if contender_dist < closest_dist:
+                        closest = contender
+                        closest_dist = contender_dist
+
+        return closest
+
+
+    @staticmethod
+    def ring_keys(ci, cj, ring):
+        if ring == 0:
+            yield ci, cj
+            return
+
+        for i in range(ci - ring, ci + ring + 1):
+            yield i, cj - ring
+            yield i, cj + ring
+
+        for j in range(cj - ring + 1, cj + ring):
+            yield ci - ring, j
+            yield ci + ring, j
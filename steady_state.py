@@ -0,0 +1,162 @@
+'''Warm-up detection and steady-state early termination.
+
+The detector is an opt-in diagnostic: it runs only when
+STEADY_STATE_INTERVAL_HRS is set. It samples the delivered parcels' time and
+the holdings every STEADY_STATE_INTERVAL_HRS, reading maintained counters
+rather than scanning storages and movers. The warm-up is found with MSER-5: the truncation
+point that minimizes the standard error of the mean of what is left. If that
+point lies in the second half of the series, the run has not settled yet.
+
+Results get the warm-up length and steady-state estimates of the tracked
+metrics with the warm-up discarded. With STEADY_STATE_EARLY_STOP the run ends
+as soon as the batch-means confidence interval of every tracked metric is
+within STEADY_STATE_TOLERANCE of its mean.
+'''
+
+import numpy as np
+
+from utils import confidence_interval, relative_precision
+
+
+def batch_sums(values, batch_size):
+    '''Sums of consecutive batches; the tail that does not fill a batch is dropped'''
+    n = len(values) // batch_size
+    return values[:n * batch_size].reshape(n, batch_size).sum(axis = 1)
+
+
+def batch_means(values, weights, batch_size):
+    values = batch_sums(values, batch_size)
+    weights = batch_sums(weights, batch_size)
+
+    # пачка без доставленных посылок - это начало прогона, его MSER и так отрежет
+    return np.divide(values, weights, out = np.zeros(len(values)), where = weights > 0)
+
+
+def mser(values, weights, batch_size = 5):
+    '''Warm-up length in samples by MSER-batch_size, or None while the
+    series has not settled'''
+
+    means = batch_means(values, weights, batch_size)
+    n = len(means)
+    if n < 4:
+        return None
+
+    # суммы хвостов means[d:] для всех d разом
+    tail_sum = np.cumsum(means[::-1])[::-1]
+    tail_sq_sum = np.cumsum(means[::-1]**2)[::-1]
+    tail_len = np.arange(n, 0, -1)
+
+    d = np.arange(n - 1)
+    stat = (tail_sq_sum[d] - tail_sum[d]**2 / tail_len[d]) / tail_len[d]**2
+    truncation = int(np.argmin(stat))
+
+    if truncation > n // 2:
+        return None
+    return truncation * batch_size
+
+
+class SteadyStateDetector:
+
+    # уровни берутся из счетчиков env.parcels_held, без обхода складов и машин
+    LEVELS = {'parcels_in_hold_wh_total': 'Склад',
+              'parcels_in_hold_courier_total': 'Курьер',
+              'parcels_in_hold_truck_total': 'Грузовик'}
+
+    MSER_BATCH_SIZE = 5
+    CONFIDENCE_BATCHES = 10
+
+    def __init__(self, env):
+        self.env = env
+        self.interval = env.STEADY_STATE_INTERVAL_HRS
+
+        self.time_sums = []
+        self.delivered = []
+        self.levels = {key: [] for key in [*self.LEVELS, 'parcels_in_hold_wh_central']}
+        self.stopped_early = False
+
+        env.process(self.run())
+
+
+    def run(self):
+        while True:
+            yield self.env.timeout(self.interval)
+            self.sample()
+
+            # проверка идет по всему ряду, поэтому делаем ее раз в пачку
+            if self.env.STEADY_STATE_EARLY_STOP and len(self.delivered) % self.MSER_BATCH_SIZE == 0 \
+                    and self.converged():
+                self.stopped_early = True
+                self.env.info('KPI вышли на стационарный режим, разгон %.2f ч, останавливаю прогон',
+                              self.warmup_samples() * self.interval)
+                self.env.stop()
+                return
+
+
+    def sample(self):
+        archive = self.env.parcel_generator.archive
+        self.time_sums.append(archive.sums['time_total'])
+        self.delivered.append(len(archive))
+
+        held = self.env.parcels_held
+        for key, object_type in self.LEVELS.items():
+            self.levels[key].append(held[object_type])
+        self.levels['parcels_in_hold_wh_central'].append(
+            len(self.env.truck_dispatcher.central_wh.parcels_in_hold))
+
+
+    def series(self):
+        '''name: (values, weights) per sample; a weighted mean over any span
+        of samples is the metric's mean over that span'''
+
+        ones = np.ones(len(self.delivered))
+        series = {'parcel_time_total': (np.diff(self.time_sums, prepend = 0.0),
+                                        np.diff(self.delivered, prepend = 0).astype(float))}
+        for key, values in self.levels.items():
+            series[key] = (np.array(values, dtype = float), ones)
+        return series
+
+
+    def warmup_samples(self, series = None):
+        truncations = [mser(values, weights, self.MSER_BATCH_SIZE)
+                       for values, weights in (series or self.series()).values()]
+        if None in truncations:
+            return None
+        return max(truncations)
+
+
+    def converged(self):
+        series = self.series()
+        warmup = self.warmup_samples(series)
+        if warmup is None:
+            return False
+
+        batch_size = (len(self.delivered) - warmup) // self.CONFIDENCE_BATCHES
+        if batch_size < self.MSER_BATCH_SIZE:
+            return False
+
+        for values, weights in series.values():
+            # пачка без доставок - пустая система, а не сошедшиеся KPI
+            if not batch_sums(weights[warmup:], batch_size).all():
+                return False
+
+            means = batch_means(values[warmup:], weights[warmup:], batch_size)
+            if relative_precision(*confidence_interval(means)) > self.env.STEADY_STATE_TOLERANCE:
+                return False
+
+        return True
+
+
+    def post_metrics(self, m):
+        pass
+
+
+    def post_results(self, m):
+        series = self.series()
+        warmup = self.warmup_samples(series)
+
+        m['steady_state_stopped_early'] = int(self.stopped_early)
+        m['warmup_hrs'] = None if warmup is None else warmup * self.interval
+
+        for key, (values, weights) in series.items():
+            weight = weights[warmup:].sum() if warmup is not None else 0
+            m[f'{key}_steady'] = values[warmup:].sum() / weight if weight else None
@@ -0,0 +1,150 @@
+'''Parameter sweep over config.ini overrides on a process pool.
+
+Examples:
+    python sweep.py COURIERS_PER_WAREHOUSE=3,5,7 TRUCKS_NUMBER=5,10
+    python sweep.py --runs runs.json --workers 8 --seed 42
+    python sweep.py COURIER_DISPATCHER=cd_one_parcel,cd_batch --replications 5 --crn
+
+Every combination of the grid (or every dict in the --runs JSON list) becomes
+one simulation with its own seed, log and metrics file. The result rows are
+collected into sweeps/<timestamp>.csv. With --crn every replication feeds
+the same parcel stream to all configs, which makes their differences far
+less noisy than with independent seeds.
+'''
+
+import argparse
+import concurrent.futures
+import datetime
+import itertools
+import json
+import os
+import random
+import shutil
+
+import run_cache
+from results import ResultsStore
+from utils import parse_config_value
+
+
+def run_simulation(overrides, seed, run_id, use_cache = True):
+    from main import DeliveryEnvironment, load_config
+
+    # без seed прогон невоспроизводим, и кэшировать его нечего
+    key = run_cache.run_key(load_config(overrides), seed) \
+        if use_cache and seed is not None else None
+
+    cached = run_cache.load_run(key) if key else None
+    if cached:
+        results, metrics_path = cached
+        os.makedirs('metrics', exist_ok = True)
+        shutil.copyfile(metrics_path, f'metrics/{run_id}{os.path.splitext(metrics_path)[1]}')
+
+        # в хранилище строка попадает так же, как у посчитанного прогона
+        results = {**results, 'timestamp': run_id}
+        ResultsStore().append(results)
+        return results
+
+    env = DeliveryEnvironment(overrides, seed, run_id)
+    try:
+        env.simulate()
+        results = env.metrics.collect_results()
+        ResultsStore().append(results)
+    finally:
+        env.close()
+
+    if key:
+        run_cache.save_run(key, results, env.metrics.sink.path)
+
+    return results
+
+
+def expand_grid(grid):
+    keys = list(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*grid.values())]
+
+
+def parse_grid(assignments):
+    grid = {}
+    for assignment in assignments:
+        key, _, values = assignment.partition('=')
+        if not values:
+            raise ValueError(f'Ожидается КЛЮЧ=значение1,значение2,..., получено {assignment}')
+        grid[key.upper()] = [parse_config_value(v) for v in values.split(',')]
+    return grid
+
+
+def sweep_jobs(runs, seed, replications = 1, crn = False):
+    '''(config index, replication, seed) for every run of the sweep.
+
+    With common random numbers replication r of every config uses the same
+    seed, so the configs are compared on identical parcel streams.'''
+
+    jobs = []
+    for r in range(replications):
+        for x in range(len(runs)):
+            run_seed = seed + r if crn else seed + r * len(runs) + x
+            jobs.append((x, r, run_seed))
+    return jobs
+
+
+def run_sweep(runs, workers = None, seed = None, sweep_id = None, use_cache = True,
+              replications = 1, crn = False):
+    '''Run every overrides dict in runs and return their results as a DataFrame.
+
+    A run that raises does not abort the sweep: its row holds the overrides,
+    the seed and the exception in the 'error' column.'''
+    # модуль импортируют все процессы пула ради run_simulation, им это не нужно
+    import pandas as pd
+    import tqdm
+
+    if seed is None:
+        seed = random.randrange(2**32)
+    if sweep_id is None:
+        sweep_id = datetime.datetime.now().strftime("%m%d-%H%M%S")
+
+    rows = []
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        futures = {pool.submit(run_simulation, runs[x], run_seed, f'{sweep_id}-{x}-{r}', use_cache):
+                   (x, r, run_seed) for x, r, run_seed in sweep_jobs(runs, seed, replications, crn)}
+
+        for future in tqdm.tqdm(concurrent.futures.as_completed(futures), total = len(futures)):
+            x, r, run_seed = futures[future]
+            try:
+                row = future.result()
+            except Exception as e:
+                tqdm.tqdm.write(f'Прогон {x}, повтор {r} упал: {e!r}')
+                row = {**{key.lower(): value for key, value in runs[x].items()},
+                       'seed': run_seed, 'error': repr(e)}
+            row['sweep_run'], row['replication'] = x, r
+            rows.append(row)
+
+    return pd.DataFrame(rows).sort_values(['sweep_run', 'replication'], ignore_index = True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Прогон сетки параметров из config.ini')
+    parser.add_argument('grid', nargs = '*', help = 'КЛЮЧ=значение1,значение2,...')
+    parser.add_argument('--runs', help = 'JSON-файл со списком словарей переопределений')
+    parser.add_argument('--workers', type = int, default = os.cpu_count())
+    parser.add_argument('--seed', type = int, help = 'базовый seed, у прогона N будет seed + N')
+    parser.add_argument('--replications', type = int, default = 1, help = 'повторов каждой конфигурации')
+    parser.add_argument('--crn', action = 'store_true',
+                        help = 'общие случайные числа: повтор R всех конфигураций с seed + R')
+    parser.add_argument('--no-cache', action = 'store_true', help = 'не брать прогоны из кэша')
+    args = parser.parse_args()
+
+    runs = expand_grid(parse_grid(args.grid))
+    if args.runs:
+        with open(args.runs, encoding = 'utf-8') as f:
+            runs = [{**r, **g} for r in json.load(f) for g in runs]
+
+    sweep_id = datetime.datetime.now().strftime("%m%d-%H%M%S")
+    results = run_sweep(runs, args.workers, args.seed, sweep_id, not args.no_cache,
+                        args.replications, args.crn)
+
+    os.makedirs('sweeps', exist_ok = True)
+    results.to_csv(f'sweeps/{sweep_id}.csv', index = None)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,6 @@
 import collections
 
-from ortools.constraint_solver import routing_enums_pb2
-from ortools.constraint_solver import pywrapcp
-
+import route_cache
 from base import DispatcherAbstract, ParcelMover
 from utils import dist
 
@@ -24,9 +22,15 @@ class TruckDispatcher(DispatcherAbstract):
         self.trucks = [ParcelMover(env, 'Грузовик', env.TRUCK_SPEED_KMH, x, self, self.central_wh) 
                        for x in range(env.TRUCKS_NUMBER)]
 
+        # грузовики, которым по текущему плану ехать некуда
+        self.idle_trucks = set()
+
         self.debug('Рассчитываю шаблонные маршруты грузовиков')
         self.compose_routes()
 
+        if env.ROUTE_REPLAN_INTERVAL_HRS:
+            env.process(self.replan())
+
 
     def cycle_start_event(self):
         return self.movers_awaiting_dispatch_present
@@ -34,8 +38,40 @@ class TruckDispatcher(DispatcherAbstract):
 
     def compose_routes(self):
 
-        # Create the routing index manager.
         central_wh_index = self.whs.index(self.central_wh)
+        key = route_cache.plan_key(self.wh_dist_matrix, len(self.trucks), 
+                                   central_wh_index, self.env.MAX_ROUTE_LEN)
+
+        plan = route_cache.load_plan(key) if self.env.ROUTE_CACHE else None
+
+        if plan is None:
+            plan = self.solve_routes(central_wh_index)
+            if self.env.ROUTE_CACHE:
+                route_cache.save_plan(key, plan)
+        else:
+            self.debug('Маршруты взяты из кэша')
+
+        self.plan = plan
+        self.routes = [CircularRoute(self, truck, self.route_segments(nodes))
+                       for truck, nodes in zip(self.trucks, plan)]
+
+        self.route_by_truck = {r.truck: r for r in self.routes}
+
+        for r in self.routes:
+            r.assign_next_segment()
+
+
+    def route_segments(self, nodes):
+        segments = collections.deque(self.whs[node] for node in nodes)
+        segments.rotate(-1)
+        return segments
+
+
+    def solve_routes(self, central_wh_index):
+        # OR-Tools грузится долго, а при маршрутах из кэша он не нужен вовсе
+        from ortools.constraint_solver import pywrapcp
+
+        # Create the routing index manager.
         manager = pywrapcp.RoutingIndexManager(len(self.wh_dist_matrix),
                                             len(self.trucks), central_wh_index)
 
@@ -69,40 +105,159 @@ class TruckDispatcher(DispatcherAbstract):
         # [END distance_constraint]
 
         # Setting first solution heuristic.
-        search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-        search_parameters.first_solution_strategy = (
-            routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC)
+        search_parameters = self.search_parameters()
 
         # Solve the problem.
         solution = routing.SolveWithParameters(search_parameters)
 
-        if solution:
-            
-            self.routes = []
-            for vehicle_id, truck in enumerate(self.trucks):
-                index = routing.Start(vehicle_id)
-                segments = collections.deque()
-                while not routing.IsEnd(index):
-                    node_index = manager.IndexToNode(index)
-                    segments.append(self.whs[node_index])
-                    index = solution.Value(routing.NextVar(index))
-                segments.rotate(-1)
-                self.routes.append(CircularRoute(self, truck, segments))
-                
-        else:
+        if not solution:
             raise RuntimeError('Не могу построить маршруты грузовиков')
 
-        for r in self.routes:
-            r.assign_next_segment()
+        return self.read_plan(routing, manager, solution)
+
+
+    def read_plan(self, routing, manager, solution):
+        plan = []
+        for vehicle_id in range(len(self.trucks)):
+            index = routing.Start(vehicle_id)
+            nodes = []
+            while not routing.IsEnd(index):
+                nodes.append(manager.IndexToNode(index))
+                index = solution.Value(routing.NextVar(index))
+            plan.append(nodes)
+
+        return plan
+
+
+    def replan(self):
+        central_wh_index = self.whs.index(self.central_wh)
+
+        while True:
+            yield self.env.timeout(self.env.ROUTE_REPLAN_INTERVAL_HRS)
+
+            demands = self.backlogs()
+            plan = self.solve_backlog_routes(central_wh_index, demands)
+
+            if plan is None:
+                self.info('Не удалось перестроить маршруты, оставляю прежние')
+                continue
+
+            self.debug('Маршруты перестроены под очереди: %s', demands)
+            self.apply_plan(plan)
+
+
+    def backlogs(self):
+        '''Посылок к перевозке по складам: ждущие грузовика на складе
+        и ждущие на центральном складе отправки на этот склад'''
+
+        index = {wh: i for i, wh in enumerate(self.whs)}
+        demands = [0] * len(self.whs)
+
+        for i, wh in enumerate(self.whs):
+            for last_mile_wh, parcels in wh.parcels_awaiting_trucks.items():
+                if wh == self.central_wh:
+                    demands[index[last_mile_wh]] += len(parcels)
+                else:
+                    demands[i] += len(parcels)
+
+        # склад с очередью больше грузовика иначе не попадет ни в один маршрут
+        return [min(d, self.env.TRUCK_CAPACITY_PARCELS) for d in demands]
+
+
+    def solve_backlog_routes(self, central_wh_index, demands):
+        '''Маршруты под текущие очереди: пустые склады можно пропускать,
+        склад с очередью пропускать дороже любого маршрута. Поиск
+        начинается с действующего плана'''
+        from ortools.constraint_solver import pywrapcp, routing_enums_pb2
+
+        manager = pywrapcp.RoutingIndexManager(len(self.whs), len(self.trucks), central_wh_index)
+        routing = pywrapcp.RoutingModel(manager)
+
+        # решатель отбрасывает дробную часть стоимостей, поэтому считаем в метрах;
+        # матрица и вектор передаются в решатель целиком, без обратных вызовов в Python
+        dist_matrix_m = [[int(d * 1000) for d in row] for row in self.wh_dist_matrix]
+        transit_callback_index = routing.RegisterTransitMatrix(dist_matrix_m)
+        routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
+
+        max_route_len_m = int(self.env.MAX_ROUTE_LEN * 1000)
+        routing.AddDimension(transit_callback_index, 0, max_route_len_m, True, 'Distance')
+        routing.GetDimensionOrDie('Distance').SetGlobalSpanCostCoefficient(100)
+
+        demand_callback_index = routing.RegisterUnaryTransitVector(demands)
+        routing.AddDimensionWithVehicleCapacity(
+            demand_callback_index, 0, [self.env.TRUCK_CAPACITY_PARCELS] * len(self.trucks), 
+            True, 'Capacity')
+
+        penalty_per_parcel = max_route_len_m * len(self.trucks)
+        for node, demand in enumerate(demands):
+            if node != central_wh_index:
+                routing.AddDisjunction([manager.NodeToIndex(node)], demand * penalty_per_parcel)
+
+        # жадный спуск от текущего плана детерминирован и быстро сходится; поиск
+        # ограничен числом решений, чтобы план не зависел от скорости машины,
+        # а лимит времени только страхует и в обычных прогонах не достигается
+        search_parameters = pywrapcp.DefaultRoutingSearchParameters()
+        search_parameters.first_solution_strategy = (
+            routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC)
+        search_parameters.local_search_metaheuristic = (
+            routing_enums_pb2.LocalSearchMetaheuristic.GREEDY_DESCENT)
+        if self.env.ROUTE_REPLAN_SOLUTION_LIMIT:
+            search_parameters.solution_limit = self.env.ROUTE_REPLAN_SOLUTION_LIMIT
+        search_parameters.time_limit.FromMilliseconds(int(self.env.ROUTE_REPLAN_TIME_LIMIT_SEC * 1000))
+        routing.CloseModelWithParameters(search_parameters)
+
+        initial_routes = [[node for node in nodes if node != central_wh_index] for nodes in self.plan]
+        initial_solution = routing.ReadAssignmentFromRoutes(initial_routes, True)
+
+        if initial_solution:
+            solution = routing.SolveFromAssignmentWithParameters(initial_solution, search_parameters)
+        else:
+            # прежний план не влезает в вместимость при новых очередях
+            solution = routing.SolveWithParameters(search_parameters)
+
+        return self.read_plan(routing, manager, solution) if solution else None
+
+
+    def apply_plan(self, plan):
+        self.plan = plan
+        for route, nodes in zip(self.routes, plan):
+            route.replan(self.route_segments(nodes))
+
+        for truck in list(self.idle_trucks):
+            self.idle_trucks.discard(truck)
+            self.assign_task(truck)
+
+
+    def search_parameters(self):
+        from ortools.constraint_solver import pywrapcp, routing_enums_pb2
+
+        search_parameters = pywrapcp.DefaultRoutingSearchParameters()
+        search_parameters.first_solution_strategy = (
+            routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC)
+
+        metaheuristic = self.env.ROUTE_SOLVER_METAHEURISTIC
+        time_limit = self.env.ROUTE_SOLVER_TIME_LIMIT_SEC
+
+        search_parameters.local_search_metaheuristic = getattr(
+            routing_enums_pb2.LocalSearchMetaheuristic, metaheuristic)
+
+        if time_limit:
+            search_parameters.time_limit.FromMilliseconds(int(time_limit * 1000))
+        elif metaheuristic not in ('AUTOMATIC', 'GREEDY_DESCENT'):
+            # остальные метаэвристики без лимита времени не останавливаются
+            raise ValueError(f'Для {metaheuristic} нужно задать ROUTE_SOLVER_TIME_LIMIT_SEC')
+
+        return search_parameters
     
 
     def assign_task(self, mover):
         route = self.find_route(mover)
-        route.assign_next_segment()
+        if not route.assign_next_segment():
+            self.idle_trucks.add(mover)
         
 
     def find_route(self, truck):
-        return self.routes[[r.truck for r in self.routes].index(truck)]
+        return self.route_by_truck[truck]
 
 
     def post_metrics(self, m):
@@ -138,15 +293,36 @@ class CircularRoute:
         self.td = td
         self.truck = truck
         self.segments = segments
-        self.peripheral_whs = {wh for wh in self.segments 
-                               if wh != td.central_wh}
+        self.stops = set(segments)
+        self.peripheral_whs = self.stops - {td.central_wh}
+
+        # посылки в грузовике по остановке, где их выгрузят; под None - те,
+        # что едут дальше через центральный склад
+        self.onboard = collections.defaultdict(set)
+
+
+    def replan(self, segments):
+        self.segments = segments
+        self.stops = set(segments)
+        self.peripheral_whs = self.stops - {self.td.central_wh}
+
+        onboard = collections.defaultdict(set)
+        for parcels in self.onboard.values():
+            for p in parcels:
+                onboard[self.unload_stop(p)].add(p)
+        self.onboard = onboard
+
+
+    def unload_stop(self, parcel):
+        return parcel.last_mile_wh if parcel.last_mile_wh in self.stops else None
 
     
     def assign_next_segment(self):
+        '''False, если грузовику по маршруту ехать некуда'''
         t = self.truck
         
-        if len(self.segments) == 1:
-            return
+        if len(self.segments) == 1 and t.current_storage == self.segments[0]:
+            return False
         
         current_wh = t.current_storage
         central_wh = self.td.central_wh        
@@ -155,26 +331,27 @@ class CircularRoute:
         self.segments.rotate(-1)
         
         if target_wh != current_wh:
-            self.td.debug(f'Отдаю задачу {self.truck} ехать на {target_wh}')
+            self.td.debug('Отдаю задачу %s ехать на %s', self.truck, target_wh)
             
             if current_wh == central_wh:
-                to_load = {p for p in central_wh.get_parcels_awaiting_trucks()
-                           if p.last_mile_wh in self.peripheral_whs}
+                to_load = central_wh.get_parcels_awaiting_trucks(self.peripheral_whs)
             else:
                 to_load = current_wh.get_parcels_awaiting_trucks()
-            
-            resulting_parcels = to_load | t.parcels_in_hold
 
-            if target_wh == central_wh:
-                to_unload = {p for p in resulting_parcels 
-                             if p.last_mile_wh not in self.segments}
-            else:
-                to_unload = {p for p in resulting_parcels 
-                             if p.last_mile_wh == target_wh}
+            # что не влезло, ждет следующего визита; первыми берем самые старые посылки
+            free = self.td.env.TRUCK_CAPACITY_PARCELS - len(t.parcels_in_hold)
+            if len(to_load) > free:
+                to_load = set(sorted(to_load, key = lambda p: p.uid)[:max(free, 0)])
+
+            for p in to_load:
+                self.onboard[self.unload_stop(p)].add(p)
+
+            to_unload = self.onboard.pop(None if target_wh == central_wh else target_wh, set())
             
         else:
-            self.td.debug(f'{self.truck} получил указание стоять на месте')
+            self.td.debug('%s получил указание стоять на месте', self.truck)
             to_load = {}
             to_unload = {}
             
-        t.accept_task(target_wh, to_load, to_unload)
\ No newline at end of file
+        t.accept_task(target_wh, to_load, to_unload)
+        return True
\ No newline at end of file
@@ -1,7 +1,26 @@
+import collections
+import enum
+import itertools
+import os
+import random
+import shutil
+
+import numpy as np
 import pytest
 import simpy
 from main import DeliveryEnvironment
-from base import Timer
+from base import StorageAbstract, Timer
+from utils import dist
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture(autouse = True)
+def workdir(tmp_path, monkeypatch):
+    # прогоны пишут logs/, metrics/, кэши и результаты в текущую папку, а не в репозиторий
+    shutil.copy(os.path.join(ROOT, 'config.ini'), tmp_path)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
 
 
 @pytest.fixture
@@ -10,16 +29,17 @@ def get_env():
 
 def test_timer():
     env = simpy.Environment()
-    timer = Timer(env, [0, 1])
+    Category = enum.Enum('Category', ['A', 'B'])
+    timer = Timer(env, Category)
     
     def run(env, timer):
-        timer.punch(0)
+        timer.punch(Category.A)
         yield env.timeout(1)
-        timer.punch(1)
+        timer.punch(Category.B)
         yield env.timeout(2)
-        timer.punch(0)
+        timer.punch(Category.A)
         yield env.timeout(3)
-        timer.punch(0)
+        timer.punch(Category.A)
         yield env.timeout(3)
         timer.punch(None)
 
@@ -27,8 +47,9 @@ def test_timer():
     env.run()
     
     assert timer.total() == 9
-    assert timer.timings[0] == 7
-    assert timer.timings[1] == 2
+    assert timer.timings[Category.A] == 7
+    assert timer.timings[Category.B] == 2
+    assert timer[Category.B] == 2
     
     
 def test_td(get_env):
@@ -43,3 +64,401 @@ def test_td(get_env):
         
     assert len(wh) == len(env.warehouses)
             
+
+
+def test_grid_index_nearest():
+    from spatial import GridIndex
+    from utils import dist
+
+    class Point:
+        def __init__(self, x, y):
+            self.x, self.y = x, y
+
+    rng = random.Random(0)
+    points = [Point(rng.uniform(-17, 17), rng.uniform(-17, 17)) for _ in range(500)]
+    index = GridIndex(2, points)
+
+    for p in points[::2]:
+        index.discard(p)
+    remaining = points[1::2]
+
+    for _ in range(200):
+        x, y = rng.uniform(-20, 20), rng.uniform(-20, 20)
+        expected = min(remaining, key = lambda p: dist(x, y, p.x, p.y))
+        assert index.nearest(x, y) is expected
+
+
+def test_parcel_archive_retires_delivered(get_env):
+    env = get_env
+    env.run(until = 20)
+
+    pg = env.parcel_generator
+    archive = pg.archive
+    assert len(archive) > 0
+    assert len(archive) + len(pg.parcels) == pg.parcels_generated
+    assert not set(archive.to_columns()['id']) & set(pg.parcels)
+    assert archive.sums['time_total'] == pytest.approx(archive.to_columns()['time_total'].sum())
+
+
+def test_sweep_grid():
+    from sweep import expand_grid, parse_grid, sweep_jobs
+
+    grid = parse_grid(['trucks_number=5,10', 'PARCEL_INTERVAL_HRS=0.01,0.02'])
+    assert grid == {'TRUCKS_NUMBER': [5, 10], 'PARCEL_INTERVAL_HRS': [0.01, 0.02]}
+    assert len(expand_grid(grid)) == 4
+    assert expand_grid({}) == [{}]
+
+    jobs = sweep_jobs([{}, {}], seed = 7, replications = 2, crn = True)
+    assert [seed for x, r, seed in jobs] == [7, 7, 8, 8]
+    assert len({seed for x, r, seed in sweep_jobs([{}, {}], 7, 2)}) == 4
+
+
+def test_replication_confidence_interval():
+    from utils import confidence_interval, relative_precision, t_quantile
+
+    assert t_quantile(0.975, 1) == pytest.approx(12.706, abs = 1e-3)
+    assert t_quantile(0.975, 2) == pytest.approx(4.303, abs = 1e-3)
+    assert t_quantile(0.995, 2) == pytest.approx(9.925, abs = 1e-3)
+    assert t_quantile(0.975, 4) == pytest.approx(2.776, abs = 1e-3)
+    assert t_quantile(0.975, 10) == pytest.approx(2.228, abs = 1e-3)
+    assert t_quantile(0.975, 30) == pytest.approx(2.042, abs = 1e-3)
+
+    mean, half_width = confidence_interval([9, 10, 11, 10, 10])
+    assert mean == 10
+    assert half_width == pytest.approx(2.776 * 0.7071 / 5**0.5, rel = 1e-3)
+    assert relative_precision(*confidence_interval([3, 3, 3])) == 0
+    assert relative_precision(*confidence_interval([1])) == float('inf')
+
+
+def test_mser_warmup():
+    from steady_state import mser
+
+    rng = np.random.default_rng(0)
+    ones = np.ones(500)
+
+    ramp = np.concatenate([np.linspace(0, 10, 100), 10 + rng.normal(size = 400)])
+    assert 50 <= mser(ramp, ones) <= 150
+
+    assert mser(np.arange(500.0), ones) is None
+
+    # взвешенный ряд: время посылок по интервалам и число доставленных
+    delivered = rng.integers(1, 5, size = 500).astype(float)
+    assert mser(delivered * 7, delivered) == 0
+
+
+def test_steady_state_levels_match_scans():
+    env = DeliveryEnvironment({'STEADY_STATE_INTERVAL_HRS': 0.5}, seed = 3)
+    detector = env.steady_state
+    try:
+        for until in [3, 6, 9]:
+            env.run(until = until)
+            detector.sample()
+
+            m = {}
+            env.warehouse_manager.post_metrics(m)
+            env.truck_dispatcher.post_metrics(m)
+            for key, values in detector.levels.items():
+                assert values[-1] == m[key]
+    finally:
+        env.close()
+
+
+def test_fork_continues_warmed_up_run():
+    from snapshot import WarmedUpSimulation
+
+    overrides = {'SIMULATION_TIME_HRS': 12}
+    env = DeliveryEnvironment(overrides, seed = 4, run_id = 'test-full')
+    env.run(until = env.SIMULATION_TIME_HRS)
+    full = env.metrics.collect_results()
+    env.close()
+
+    simulation = WarmedUpSimulation(6, overrides, seed = 4, run_id = 'test-warmup')
+    try:
+        same, slower = simulation.fork([{}, {'COURIER_WAREHOUSE_PICKUP_TIME_HRS': 1}], save = False)
+        with pytest.raises(ValueError):
+            simulation.fork([{'TRUCKS_NUMBER': 1}], save = False)
+
+        # потомок, умерший без результата, не вешает родителя
+        simulation.continue_run = lambda *args: os._exit(3)
+        with pytest.raises(RuntimeError, match = 'кодом 3'):
+            simulation.fork([{}], save = False)
+    finally:
+        simulation.close()
+
+    for key in ['parcels_generated', 'parcels_delivered_total', 'odo_courier_total', 'odo_truck_total']:
+        assert same[key] == full[key]
+    assert same['fork_time_hrs'] == 6
+    assert slower['parcels_generated'] == full['parcels_generated']
+    assert slower['courier_warehouse_pickup_time_hrs'] == 1
+
+
+def test_benchmark_regressions():
+    from benchmarks.__main__ import compare
+
+    baselines = {'micro': {'post_metrics': 2.0},
+                 'scaling': {'couriers_5': {'events_per_sec': 1000, 'wall_ms_per_sim_hr': 20}}}
+    results = {'micro': {'post_metrics': 2.4},
+               'scaling': {'couriers_5': {'events_per_sec': 700, 'wall_ms_per_sim_hr': 19}}}
+
+    assert [key for key, *_ in compare(results, baselines, 0.25)] == ['scaling/couriers_5/events_per_sec']
+    assert len(compare(results, baselines, 0.1)) == 2
+
+
+def test_route_replanning_follows_backlogs():
+    env = DeliveryEnvironment({'SIMULATION_TIME_HRS': 12, 'ROUTE_REPLAN_INTERVAL_HRS': 4}, seed = 3)
+    td = env.truck_dispatcher
+    try:
+        env.run(until = 4.5)
+        assert all(len(td.find_route(t).segments) == 1 for t in td.idle_trucks)
+
+        demands = td.backlogs()
+        plan = td.solve_backlog_routes(td.whs.index(td.central_wh), demands)
+        visited = {node for nodes in plan for node in nodes}
+        assert all(node in visited for node, demand in enumerate(demands) if demand)
+
+        for route in td.routes:
+            assert route.stops == set(route.segments)
+            assert all(route.unload_stop(p) == stop 
+                       for stop, parcels in route.onboard.items() for p in parcels)
+    finally:
+        env.close()
+
+
+def test_trucks_respect_capacity():
+    capacity = 10
+    env = DeliveryEnvironment({'ROUTE_REPLAN_INTERVAL_HRS': 2, 'TRUCK_CAPACITY_PARCELS': capacity}, seed = 3)
+    td = env.truck_dispatcher
+    try:
+        loaded = 0
+        for until in range(1, 13):
+            env.run(until = until)
+            holds = [len(truck.parcels_in_hold) for truck in td.trucks]
+            assert max(holds) <= capacity
+            loaded = max(loaded, *holds)
+
+        # очередь больше вместимости, и остаток ждет на складах следующего визита
+        assert loaded == capacity
+        assert any(wh.parcels_awaiting_trucks for wh in td.whs)
+    finally:
+        env.close()
+
+
+@pytest.mark.parametrize('dispatcher', ['cd_many_parcels', 'cd_one_parcel', 'cd_batch'])
+def test_dispatcher_queues_follow_movers(dispatcher):
+    env = DeliveryEnvironment({'COURIER_DISPATCHER': dispatcher}, seed = 5)
+    try:
+        for until in [2, 4, 6]:
+            env.run(until = until)
+            for wh in env.warehouse_manager.warehouses:
+                disp = wh.disp
+                assert disp.couriers_heading_to_wh == sum(1 for c in disp.couriers if c.target == wh)
+                assert list(disp.loaded_requests) == [m for m in disp.dispatch_requests if m.parcels_in_hold]
+                # склад выпадает из списка на вывоз, только если к нему едет достаточно курьеров
+                assert wh in disp.pickup_requests or \
+                    disp.couriers_needed_for_wh_pickup() <= disp.couriers_heading_to_wh
+    finally:
+        env.close()
+
+
+def test_profiling_does_not_change_run():
+    results = []
+    for profiling in [0, 1]:
+        env = DeliveryEnvironment({'PROFILING': profiling}, seed = 3)
+        try:
+            env.run(until = 12)
+            results.append(env.metrics.collect_results())
+        finally:
+            env.close()
+
+    plain, profiled = results
+    assert not any(key.startswith('profile_') for key in plain)
+    assert profiled['parcels_delivered_total'] == plain['parcels_delivered_total']
+    assert profiled['profile_events_scheduled'] >= profiled['profile_events_processed'] > 0
+    assert profiled['profile_simpy_step_calls'] == profiled['profile_events_processed']
+    assert profiled['profile_parcel_init_calls'] == profiled['parcels_generated']
+
+
+def test_headless_run_without_heavy_imports():
+    import subprocess
+    import sys
+
+    # то же, что загружает процесс пула, разворачивая run_simulation
+    code = 'import sys, main, sweep, replications; ' \
+           'print(sorted({"pandas", "ortools", "tqdm"} & set(sys.modules)))'
+    assert subprocess.check_output([sys.executable, '-c', code], cwd = ROOT, text = True).strip() == '[]'
+
+    hours = []
+    env = DeliveryEnvironment({'SIMULATION_TIME_HRS': 4, 'MONITORING_INTERVAL_HRS': 2}, seed = 2)
+    try:
+        env.simulate(progress = hours.append)
+        assert env.now == 4
+        assert hours == [2, 2]
+        assert env.progress is None
+    finally:
+        env.close()
+
+
+def test_batch_pickup_keeps_per_parcel_timing():
+    env = simpy.Environment()
+    env.debug_enabled = env.info_enabled = False
+    env.object_ids = itertools.count()
+    env.parcels_held = collections.Counter()
+
+    class Store(StorageAbstract):
+        object_type = 'Склад'
+
+        def operation_time(self, operation_type, mover):
+            return 0.5
+
+    class FakeParcel:
+        last_mile_wh = None
+
+        def pickup(self, mover, at):
+            self.picked_up_at = at
+
+    store = Store(env, 'test', 0, 0)
+    parcels = {FakeParcel() for _ in range(3)}
+    store.parcels_in_hold.update(parcels)
+
+    env.process(store.pickup_parcels(parcels, None))
+    env.run()
+
+    assert env.now == 1.5
+    assert sorted(p.picked_up_at for p in parcels) == [0.5, 1.0, 1.5]
+    assert not store.parcels_in_hold
+
+
+def test_parcel_block_generation(get_env):
+    env = get_env
+    pg = env.parcel_generator
+    whs = env.warehouse_manager.warehouses
+
+    pg.draw_block(500)
+
+    for _, sender_point, addressee_point, first_mile_wh, last_mile_wh in pg.buffer:
+        for (x, y), wh in [(sender_point, first_mile_wh), (addressee_point, last_mile_wh)]:
+            assert dist(x, y, 0, 0) <= env.CITY_RADUIS_KM
+            assert wh is min(whs, key = lambda w: dist(x, y, w.x, w.y))
+        if not env.ALLOW_SAME_WH_PARCELS:
+            assert first_mile_wh is not last_mile_wh
+
+
+def test_warehouse_layout_file(tmp_path):
+    import layouts
+
+    path = tmp_path / 'whs.csv'
+    path.write_text('x,y\n0,0\n3.5,-2\n')
+    assert layouts.load_coordinates(path) == [(0, 0), (3.5, -2)]
+
+    layout = layouts.unit_layout(7)
+    assert len(layout) == 7
+    assert all(dist(x, y, 0, 0) <= 1 for x, y in layout)
+    assert layouts.unit_layout(7) is layout
+
+
+def test_batch_courier_matching():
+    from cd_batch import CourierDispatcher
+
+    class Point:
+        def __init__(self, x, y):
+            self.x, self.y = x, y
+
+    couriers = [Point(0, 0), Point(10, 0), Point(5, 5)]
+    targets = [Point(9, 1), Point(1, 1)]
+
+    pairs = CourierDispatcher.match(couriers, targets)
+
+    assert {(couriers.index(c), targets.index(t)) for c, t in pairs} == {(0, 1), (1, 0)}
+
+
+def test_csv_metrics_sink_streams_rows(tmp_path):
+    import time
+    from metrics_sink import open_sink
+
+    sink = open_sink('csv', tmp_path / 'metrics')
+    sink.append({'time': 0, 'parcels_generated': 1})
+    sink.append({'time': 2, 'parcels_generated': None})
+
+    # строки попадают на диск еще до закрытия потока
+    deadline = time.time() + 5
+    while time.time() < deadline:
+        lines = open(sink.path, encoding = 'utf-8').read().splitlines() \
+            if os.path.exists(sink.path) else []
+        if len(lines) == 3:
+            break
+        time.sleep(0.01)
+
+    assert lines == ['time,parcels_generated', '0,1', '2,']
+    sink.close()
+
+
+def test_metrics_sinks_add_late_columns(tmp_path):
+    import pyarrow as pa
+    from metrics_sink import SINKS
+
+    rows = [{'time': 0, 'parcels_generated': 1},
+            {'time': 2, 'parcels_generated': 5, 'events_scheduled': 40},
+            {'time': 4, 'events_scheduled': 90}]
+
+    # по строке в пачке, чтобы новая колонка пришла уже после записи заголовка
+    csv_sink = SINKS['csv'](str(tmp_path / 'metrics.csv'), batch_size = 1)
+    arrow_sink = SINKS['arrow'](str(tmp_path / 'metrics.arrow'), batch_size = 1)
+    for sink in [csv_sink, arrow_sink]:
+        for row in rows:
+            sink.append(row)
+        sink.close()
+
+    assert open(csv_sink.path, encoding = 'utf-8').read().splitlines() == [
+        'time,parcels_generated,events_scheduled', '0,1,', '2,5,40', '4,,90']
+
+    with pa.OSFile(arrow_sink.path, 'rb') as f:
+        table = pa.ipc.open_stream(f).read_all()
+    assert table.to_pydict() == {'time': [0, 2, 4], 'parcels_generated': [1, 5, None],
+                                 'events_scheduled': [None, 40, 90]}
+
+
+def test_cached_run_reaches_results_store():
+    from results import ResultsStore
+    from sweep import run_simulation
+
+    computed = run_simulation({}, seed = 1, run_id = 'computed')
+    cached = run_simulation({}, seed = 1, run_id = 'cached')
+
+    assert cached['parcels_delivered_total'] == computed['parcels_delivered_total']
+    assert sorted(ResultsStore().read(columns = ['timestamp'])['timestamp']) == ['cached', 'computed']
+    assert os.path.exists('metrics/cached.csv')
+
+
+def test_results_store_adds_columns(tmp_path):
+    from results import ResultsStore
+
+    store = ResultsStore(tmp_path / 'results.sqlite')
+    store.append({'timestamp': '1', 'config_hash': 'a', 'unit_costs_total': 10})
+    store.append({'timestamp': '2', 'config_hash': 'b', 'unit_costs_total': 12, 'seed': 7})
+
+    df = store.read('config_hash = ?', ['b'])
+    assert df.to_dict('records') == [
+        {'timestamp': '2', 'config_hash': 'b', 'unit_costs_total': 12, 'seed': 7}]
+    assert len(store.read()) == 2
+
+
+def test_run_cache_key(tmp_path):
+    import run_cache
+    from main import load_config
+
+    config = load_config()
+    key = run_cache.run_key(config, 1)
+
+    assert run_cache.run_key(load_config(), 1) == key
+    assert run_cache.run_key(config, 2) != key
+    assert run_cache.run_key(load_config({'TRUCKS_NUMBER': 3}), 1) != key
+
+    assert any(path.endswith('parcel.py') for path in run_cache.source_files())
+
+    # ключ зависит от содержимого файла раскладки, а не только от пути к нему
+    layout = tmp_path / 'whs.csv'
+    layout.write_text('x,y\n0,0\n1,1\n')
+    with_layout = load_config({'WAREHOUSES_LAYOUT_FILE': str(layout)})
+    layout_key = run_cache.run_key(with_layout, 1)
+    layout.write_text('x,y\n0,0\n2,2\n')
+    assert run_cache.run_key(with_layout, 1) != layout_key
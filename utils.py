@@ -1,5 +1,10 @@
+import array
+import functools
+import hashlib
+import json
 import math
 import random
+import statistics
 from enums import ParcelMoverTimer
 
 
@@ -7,6 +12,59 @@ def dist(x1, y1, x2, y2):
     return math.sqrt((x2 - x1)**2 + (y2 - y1)**2)
 
 
+def parse_config_value(value):
+    try:
+        value = float(value)
+        if value % 1 == 0:
+            value = int(value)
+    except:
+        pass
+    return value
+
+
+def config_hash(config):
+    return hashlib.sha256(json.dumps(config, sort_keys = True).encode()).hexdigest()[:16]
+
+
+def t_quantile(p, df):
+    '''Quantile of Student's t distribution: exact for df = 1 and 2, from
+    df = 3 on a Cornish-Fisher expansion around the normal one (within 1%)'''
+
+    # при df = 1 разложение занижает квантиль на 11%, а для df <= 2 есть точные формулы
+    if df == 1:
+        return math.tan(math.pi * (p - 0.5))
+    if df == 2:
+        return (2 * p - 1) / math.sqrt(2 * p * (1 - p))
+
+    z = statistics.NormalDist().inv_cdf(p)
+    g1 = (z**3 + z) / 4
+    g2 = (5 * z**5 + 16 * z**3 + 3 * z) / 96
+    g3 = (3 * z**7 + 19 * z**5 + 17 * z**3 - 15 * z) / 384
+    g4 = (79 * z**9 + 776 * z**7 + 1482 * z**5 - 1920 * z**3 - 945 * z) / 92160
+    return z + g1 / df + g2 / df**2 + g3 / df**3 + g4 / df**4
+
+
+def confidence_interval(values, confidence = 0.95):
+    '''(mean, half width) of the t confidence interval of the mean'''
+
+    values = [float('nan') if v is None else v for v in values]
+    mean = statistics.fmean(values)
+    if len(values) < 2:
+        return mean, math.inf
+
+    half_width = t_quantile((1 + confidence) / 2, len(values) - 1) \
+        * statistics.stdev(values) / math.sqrt(len(values))
+    return mean, half_width
+
+
+def relative_precision(mean, half_width):
+    if half_width == 0:
+        return 0.0
+    if mean == 0 or math.isnan(mean):
+        return math.inf
+    return half_width / abs(mean)
+
+
 def succeed(event):
     if not event.triggered:
         event.succeed()
@@ -14,21 +72,40 @@ def succeed(event):
         
 class Timer:
     '''Keep track of what time gets spent on during an object's lifetime'''
+
+    __slots__ = ('env', 'categories', 'values', 'current', 'last_clock')
     
     def __init__(self, env, categories):
         self.env = env
         self.categories = categories
-        self.timings = {c: 0 for c in categories}
+        # время по категориям лежит в массиве по значению члена перечисления
+        self.values = self.zeros(categories)[:]
         self.current = None
+        self.last_clock = None
+
+
+    @staticmethod
+    @functools.cache
+    def zeros(categories):
+        return array.array('d', [0.0] * (max(c.value for c in categories) + 1))
         
     
-    def punch(self, new_category):
-        now = self.env.now
+    def punch(self, new_category, at = None):
+        now = self.env.now if at is None else at
         if self.current != None:
-            self.timings[self.current] += now - self.last_clock
+            self.values[self.current.value] += now - self.last_clock
         self.last_clock = now
         self.current = new_category
+
+
+    def __getitem__(self, category):
+        return self.values[category.value]
+
+
+    @property
+    def timings(self):
+        return {c: self.values[c.value] for c in self.categories}
         
     
     def total(self):
-        return sum(self.timings.values())
\ No newline at end of file
+        return sum(self.values)
\ No newline at end of file
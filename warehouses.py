@@ -1,9 +1,10 @@
+import importlib
 import itertools
 
-from circlify import circlify
+import numpy as np
 
+import layouts
 from base import ParcelMoverTimer, SimulationObject, Warehouse
-from cd_many_parcels import CourierDispatcher
 
 class WarehouseManager(SimulationObject):
 
@@ -12,18 +13,34 @@ class WarehouseManager(SimulationObject):
     def __init__(self, env):
         super().__init__(env, None, 0, 0)
         
+        self.CourierDispatcher = importlib.import_module(env.COURIER_DISPATCHER).CourierDispatcher
+
         self.debug('Расставляю склады')
-        env.log.setLevel("ERROR")
-        circles = circlify([1 for i in range(self.env.WAREHOUSES_NUMBER)])
-        env.log.setLevel(self.env.LOGGING_LEVEL)
+        points = self.warehouse_points()
 
-        radius = self.env.CITY_RADUIS_KM
         self.warehouses = [
-            Warehouse(CourierDispatcher, env, x, c.x * radius, c.y * radius) 
-            for x, c in enumerate(circles)
+            Warehouse(self.CourierDispatcher, env, x, wh_x, wh_y) 
+            for x, (wh_x, wh_y) in enumerate(points)
         ]
+
+        self.coords = np.array([(wh.x, wh.y) for wh in self.warehouses])
         
         
+    def warehouse_points(self):
+        env = self.env
+
+        if env.WAREHOUSES_LAYOUT_FILE:
+            points = layouts.load_coordinates(env.WAREHOUSES_LAYOUT_FILE)
+
+            # число складов задается файлом, от него считаются и затраты
+            env.WAREHOUSES_NUMBER = len(points)
+            env.flat_config['warehouses_number'] = len(points)
+            return points
+
+        radius = env.CITY_RADUIS_KM
+        return [(x * radius, y * radius) for x, y in layouts.unit_layout(env.WAREHOUSES_NUMBER)]
+
+
     def post_metrics(self, m):
         all_couriers = list(itertools.chain(*[wh.disp.couriers for wh in self.warehouses]))
         
@@ -42,7 +59,7 @@ class WarehouseManager(SimulationObject):
 
             
     def post_results(self, m):
-        m['ver_disp_courier'] = CourierDispatcher.version
+        m['ver_disp_courier'] = self.CourierDispatcher.version
 
         courier_fixed_costs_mon = self.env.COURIER_COST_PER_MON \
             * self.env.COURIERS_PER_WAREHOUSE * self.env.WAREHOUSES_NUMBER
@@ -66,6 +83,6 @@ class WarehouseManager(SimulationObject):
 
         for stat_key, timing_category in bindings.items():
             m[stat_key] = sum(c.timer.timings[timing_category] for c in all_couriers) / \
-                len(all_couriers) / self.env.SIMULATION_TIME_HRS
+                len(all_couriers) / self.env.now
 
                 